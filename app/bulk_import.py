@@ -0,0 +1,222 @@
+# app/bulk_import.py
+"""
+Bulk owner/vehicle import.
+
+Rows carry owner_name, owner_phone_number and (optionally) license_plate. They
+are validated in batches with set-based duplicate detection (one query per
+batch for phones, one for plates), inserted with multi-row INSERT statements,
+committed one batch per transaction, and their QR images are rendered in a
+process pool while the next batch is being inserted.
+
+Usage:
+    python -m app.bulk_import tenants.csv [--format csv|ndjson|json] [--batch-size 1000] [--workers 8] [--render | --no-render]
+"""
+
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app import config, crud, database, models
+from app.qr_code import new_qr_data, qr_file_path_for, render_qr_png
+
+FORMATS = ("csv", "ndjson", "json")
+MAX_REPORTED_ERRORS = 1000
+
+def format_from_content_type(content_type: str | None) -> str:
+    """Maps a request Content-Type to an import format (defaults to csv)."""
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type: return "ndjson"
+    if "json" in content_type: return "json"
+    return "csv"
+
+def iter_rows(fileobj, fmt: str) -> Iterator[dict]:
+    """Streams row dicts from a binary file object. csv and ndjson are read incrementally."""
+    if fmt not in FORMATS: raise ValueError(f"Unsupported import format '{fmt}'. Use one of {FORMATS}.")
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+    elif fmt == "ndjson":
+        for line in text:
+            if line.strip(): yield json.loads(line)
+    else:
+        rows = json.load(text)
+        if not isinstance(rows, list): raise ValueError("JSON import expects a top-level array of rows.")
+        yield from rows
+
+def _batched(rows: Iterable[dict], size: int) -> Iterator[list[tuple[int, dict]]]:
+    batch = []
+    for row_number, row in enumerate(rows, start=1):
+        batch.append((row_number, row))
+        if len(batch) >= size: yield batch; batch = []
+    if batch: yield batch
+
+def _field(row, name: str) -> str:
+    value = row.get(name) if isinstance(row, dict) else None
+    return str(value).strip() if value is not None else ""
+
+class ImportReport:
+    """Counters and per-row errors for one import run."""
+
+    def __init__(self):
+        self.rows = 0
+        self.owners_created = 0
+        self.vehicles_created = 0
+        self.qr_rendered = 0
+        self.error_count = 0
+        self.errors: list[dict] = []
+        self.started = time.perf_counter()
+
+    def error(self, row_number: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS: self.errors.append({"row": row_number, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "owners_created": self.owners_created,
+            "vehicles_created": self.vehicles_created,
+            "qr_rendered": self.qr_rendered,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+            "elapsed_seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+def _validate(batch: list[tuple[int, dict]], seen_plates: set[str], report: ImportReport) -> list[tuple[int, str, str, str]]:
+    """Normalizes rows to (row_number, name, phone, plate); invalid rows go to the report."""
+    valid = []
+    for row_number, row in batch:
+        name, phone = _field(row, "owner_name"), _field(row, "owner_phone_number")
+        plate = _field(row, "license_plate").upper()
+        normalized = models.normalize_plate(plate)
+        if not name or not phone: report.error(row_number, "owner_name and owner_phone_number are required."); continue
+        if len(name) > 100 or len(phone) > 20 or len(plate) > 20: report.error(row_number, "Field too long (name <= 100, phone/plate <= 20)."); continue
+        if plate and not normalized: report.error(row_number, f"Vehicle '{plate}' has no letters or digits."); continue
+        if plate:
+            if normalized in seen_plates: report.error(row_number, f"Vehicle '{plate}' appears more than once in the import."); continue
+            seen_plates.add(normalized)
+        valid.append((row_number, name, phone, plate))
+    return valid
+
+def _import_batch(db: Session, rows: list[tuple[int, str, str, str]], report: ImportReport) -> list[tuple[int, str]]:
+    """Inserts one validated batch; returns (row_number, qr_data) for every vehicle created."""
+    phones = {phone for _, _, phone, _ in rows}
+    owner_ids = dict(db.execute(select(models.Owner.phone_number, models.Owner.id).where(models.Owner.phone_number.in_(phones))).all())
+
+    new_owners = {}
+    for _, name, phone, _ in rows:
+        if phone not in owner_ids: new_owners.setdefault(phone, name)
+    if new_owners:
+        created = db.execute(pg_insert(models.Owner).values([{"name": n, "phone_number": p} for p, n in new_owners.items()])
+                             .on_conflict_do_nothing(index_elements=[models.Owner.phone_number])
+                             .returning(models.Owner.phone_number, models.Owner.id)).all()
+        owner_ids.update(created); report.owners_created += len(created)
+        raced = set(new_owners) - set(owner_ids) # Inserted concurrently by someone else
+        if raced: owner_ids.update(db.execute(select(models.Owner.phone_number, models.Owner.id).where(models.Owner.phone_number.in_(raced))).all())
+
+    plates = {models.normalize_plate(plate) for _, _, _, plate in rows if plate}
+    existing_plates = set(db.scalars(select(models.Vehicle.plate_normalized).where(models.Vehicle.plate_normalized.in_(plates)))) if plates else set()
+    new_plates = [(row_number, phone, plate) for row_number, _, phone, plate in rows if plate]
+    for row_number, _, plate in new_plates:
+        if models.normalize_plate(plate) in existing_plates: report.error(row_number, f"Vehicle '{plate}' already registered.")
+    new_plates = [row for row in new_plates if models.normalize_plate(row[2]) not in existing_plates]
+    if not new_plates: return []
+    # Signed QR codes embed the vehicle id, so ids are reserved up front (one round trip per batch)
+    vehicle_ids = crud.allocate_vehicle_ids(db, len(new_plates)) if config.QR_SIGNING_KEY else [None] * len(new_plates)
+    pending = {plate: (row_number, new_qr_data(plate, vehicle_id), owner_ids[phone], vehicle_id)
+               for (row_number, phone, plate), vehicle_id in zip(new_plates, vehicle_ids)}
+
+    inserted = dict(db.execute(pg_insert(models.Vehicle)
+                               .values([{"license_plate": plate, "qr_code": qr, "owner_id": owner_id, **({"id": vehicle_id} if vehicle_id else {})}
+                                        for plate, (_, qr, owner_id, vehicle_id) in pending.items()])
+                               .on_conflict_do_nothing()
+                               .returning(models.Vehicle.license_plate, models.Vehicle.qr_code)).all())
+    created = []
+    for plate, (row_number, qr, _, _) in pending.items():
+        if plate in inserted: created.append((row_number, qr))
+        else: report.error(row_number, f"Vehicle '{plate}' conflicts with an existing plate or QR code.")
+    report.vehicles_created += len(created)
+    return created
+
+def run_import(fileobj, fmt: str = "csv", batch_size: int | None = None, workers: int | None = None, render_qr: bool | None = None) -> dict:
+    """
+    Imports rows from a binary file object. Each batch is its own transaction; returns the report dict.
+
+    PNG files are only written when render_qr is set, which defaults to QR_CODE_STORAGE == "files";
+    otherwise images are served on demand by /api/qr.
+    """
+    if render_qr is None: render_qr = config.QR_CODE_STORAGE == "files"
+    batch_size = batch_size or config.IMPORT_BATCH_SIZE
+    report = ImportReport()
+    seen_plates: set[str] = set()
+    renders = []
+    # spawn, not fork: run_import may be called from a worker thread of the web server
+    executor = ProcessPoolExecutor(max_workers=workers or config.IMPORT_QR_WORKERS, mp_context=multiprocessing.get_context("spawn")) if render_qr else None
+    try:
+        with database.SessionLocal() as db:
+            try:
+                for batch in _batched(iter_rows(fileobj, fmt), batch_size):
+                    report.rows += len(batch)
+                    rows = _validate(batch, seen_plates, report)
+                    if not rows: continue
+                    try:
+                        created = _import_batch(db, rows, report); db.commit()
+                    except Exception as e:
+                        db.rollback(); print(f"Error importing batch at row {batch[0][0]}: {e}")
+                        for row_number, *_ in rows: report.error(row_number, "Batch failed to insert; no rows from it were saved.")
+                        continue
+                    if executor:
+                        renders.extend((row_number, executor.submit(render_qr_png, qr, qr_file_path_for(qr))) for row_number, qr in created)
+            except (ValueError, csv.Error, UnicodeDecodeError) as e:
+                report.error(report.rows + 1, f"Unreadable input: {e}")
+        for row_number, future in renders:
+            try: future.result(); report.qr_rendered += 1
+            except Exception as e: report.error(row_number, f"Vehicle saved but QR image failed: {e}")
+    finally:
+        if executor: executor.shutdown()
+    return report.as_dict()
+
+class AsyncBodyReader(io.RawIOBase):
+    """
+    Blocking file object over an async byte stream (e.g. Request.stream()).
+
+    Lets run_import consume an upload in a worker thread as it arrives, so the
+    body is never buffered in full.
+    """
+
+    def __init__(self, stream, loop: asyncio.AbstractEventLoop):
+        self._chunks = stream.__aiter__()
+        self._loop = loop
+        self._buffer = b""
+
+    def readable(self) -> bool: return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer:
+            try: self._buffer = asyncio.run_coroutine_threadsafe(self._chunks.__anext__(), self._loop).result()
+            except StopAsyncIteration: return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]; self._buffer = self._buffer[size:]
+        return size
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Bulk import owners and vehicles.")
+    parser.add_argument("path", help="CSV, NDJSON or JSON file with owner_name, owner_phone_number, license_plate")
+    parser.add_argument("--format", choices=FORMATS, help="Input format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=config.IMPORT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=config.IMPORT_QR_WORKERS, help="QR rendering processes")
+    parser.add_argument("--render", action=argparse.BooleanOptionalAction, default=None, help="Write QR PNG files (default: only when QR_CODE_STORAGE=files)")
+    args = parser.parse_args()
+    fmt = args.format or {"ndjson": "ndjson", "jsonl": "ndjson", "json": "json"}.get(args.path.rsplit(".", 1)[-1].lower(), "csv")
+    with open(args.path, "rb") as f:
+        print(json.dumps(run_import(f, fmt, batch_size=args.batch_size, workers=args.workers, render_qr=args.render), indent=2))
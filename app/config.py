@@ -13,6 +13,43 @@ if not DATABASE_URL:
     print("CRITICAL ERROR: DATABASE_URL environment variable not set!")
     # Consider raising an error or exiting in a real application
 
+def _env_flag(name: str, default: bool) -> bool:
+    """Reads a boolean environment variable ('1', 'true', 'yes', 'on' are truthy)."""
+    value = os.getenv(name)
+    if value is None or not value.strip(): return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_int(name: str, default: int, minimum: int = 0) -> int:
+    """Reads an integer environment variable, falling back to default when missing or invalid."""
+    value = os.getenv(name)
+    if value is None or not value.strip(): return default
+    try:
+        parsed = int(value)
+        if parsed < minimum: raise ValueError
+        return parsed
+    except ValueError:
+        print(f"Warning: {name} ('{value}') is invalid. Using default: {default}")
+        return default
+
+def _async_url_from(sync_url: str | None) -> str | None:
+    """Derives an async driver URL (psycopg 3) from the sync DATABASE_URL."""
+    if not sync_url: return None
+    for prefix in ("postgresql+psycopg2://", "postgresql+psycopg://", "postgresql://", "postgres://"):
+        if sync_url.startswith(prefix): return "postgresql+psycopg://" + sync_url[len(prefix):]
+    return sync_url
+
+# Connection pool (applies to both the sync and the async engine, per worker process)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 5, minimum=1)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 30, minimum=1)    # Seconds to wait for a free connection
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800, minimum=-1) # Seconds; -1 never recycles
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", True)
+
+# Async database path: endpoints run DB work on an AsyncSession so a slow query
+# does not block the event loop. Set USE_ASYNC_DB=false to fall back to the sync Session.
+USE_ASYNC_DB = _env_flag("USE_ASYNC_DB", True)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url_from(DATABASE_URL)
+
 # --- Application Settings ---
 DEFAULT_PARKING_RATE = Decimal("20.00")
 PARKING_RATE_PER_HOUR_STR = os.getenv("PARKING_RATE_PER_HOUR")
@@ -26,11 +63,87 @@ except (TypeError, InvalidOperation, ValueError):
     print(f"Warning: PARKING_RATE_PER_HOUR not found or invalid ('{PARKING_RATE_PER_HOUR_STR}'). Using default: {DEFAULT_PARKING_RATE}")
     PARKING_RATE_PER_HOUR = DEFAULT_PARKING_RATE
 
+# Optional JSON tariff definition (time-of-day bands, grace period, daily cap, per-lot rates).
+# See app/tariff.py; without it fees are PARKING_RATE_PER_HOUR per started hour.
+TARIFF_FILE = os.getenv("TARIFF_FILE")
+
 # --- QR Code Settings ---
 # Directory to save generated QR code images (relative to project root)
 QR_CODE_DIR = "qrcodes"
 # Base URL path for accessing QR codes if served statically
 QR_CODE_URL_PATH = "/qrcodes" # Corresponds to StaticFiles mount in main.py
+# "on_demand": images are rendered by GET /api/qr/{qr_code}.{png|svg}, nothing is written at registration.
+# "files": legacy mode, registration also writes a PNG into QR_CODE_DIR.
+# Existing files under QR_CODE_URL_PATH stay served in both modes.
+QR_CODE_STORAGE = os.getenv("QR_CODE_STORAGE", "on_demand").strip().lower()
+if QR_CODE_STORAGE not in ("on_demand", "files"):
+    print(f"Warning: QR_CODE_STORAGE ('{QR_CODE_STORAGE}') is invalid. Using default: on_demand")
+    QR_CODE_STORAGE = "on_demand"
+QR_IMAGE_URL_PATH = "/api/qr"
+QR_IMAGE_CACHE_SIZE = _env_int("QR_IMAGE_CACHE_SIZE", 2048)  # Encoded images kept in memory
+
+# --- QR Resolution Cache ---
+# In-process LRU in front of the QR -> (vehicle, owner) lookup used by every scan.
+QR_CACHE_SIZE = _env_int("QR_CACHE_SIZE", 100_000)       # 0 disables the cache
+QR_CACHE_TTL_SECONDS = _env_int("QR_CACHE_TTL_SECONDS", 300)
+QR_CACHE_PREWARM = _env_flag("QR_CACHE_PREWARM", True)   # Load from `vehicles` at startup
+
+# --- Signed QR Codes ---
+# With a key, new vehicles get V1.<vehicle id>.<HMAC> codes: scans are verified in-process,
+# invalid codes are rejected without a query and valid ones are looked up by primary key.
+# Keep the key secret and identical on every worker; changing it invalidates printed codes.
+# Without a key, new codes use the legacy PLATE-<8 hex> format.
+QR_SIGNING_KEY = os.getenv("QR_SIGNING_KEY", "")
+QR_ACCEPT_LEGACY = _env_flag("QR_ACCEPT_LEGACY", True) # Still resolve PLATE-<8 hex> codes already printed
+
+# --- Bulk Import ---
+IMPORT_BATCH_SIZE = _env_int("IMPORT_BATCH_SIZE", 1000, minimum=1)   # Rows per transaction
+IMPORT_QR_WORKERS = _env_int("IMPORT_QR_WORKERS", os.cpu_count() or 1, minimum=1)  # QR render processes
+
+# --- Live Occupancy ---
+# The in-process counter is updated on every check-in/out; this resync (one query per
+# worker, not per dashboard) corrects for scans handled by other worker processes.
+OCCUPANCY_RESYNC_SECONDS = _env_int("OCCUPANCY_RESYNC_SECONDS", 60)  # 0 disables periodic resync
+OCCUPANCY_STREAM_HEARTBEAT_SECONDS = _env_int("OCCUPANCY_STREAM_HEARTBEAT_SECONDS", 15, minimum=1)
+
+# --- Reports ---
+# Day buckets in /api/reports/* are cut at midnight in this timezone (rollups are stored per UTC hour).
+REPORT_TIMEZONE = os.getenv("REPORT_TIMEZONE", "UTC")
+
+# --- Scan Deduplication ---
+# Repeated scans of the same QR code for the same action within the window are answered
+# from memory. Requests carrying an Idempotency-Key header are remembered for longer.
+SCAN_DEDUP_WINDOW_SECONDS = _env_int("SCAN_DEDUP_WINDOW_SECONDS", 2)   # 0 disables derived-key dedup
+IDEMPOTENCY_KEY_TTL_SECONDS = _env_int("IDEMPOTENCY_KEY_TTL_SECONDS", 600)
+SCAN_DEDUP_MAX_ENTRIES = _env_int("SCAN_DEDUP_MAX_ENTRIES", 10_000, minimum=1)
+
+# --- Record Partitions & Archive ---
+# parking_records is range-partitioned by exit_time month (open records live in the default
+# partition). `python -m app.partitions archive` moves whole closed months older than
+# RECORD_ARCHIVE_AFTER_MONTHS into gzipped NDJSON files under RECORD_ARCHIVE_DIR.
+RECORD_ARCHIVE_DIR = os.getenv("RECORD_ARCHIVE_DIR", "archive")
+RECORD_ARCHIVE_AFTER_MONTHS = _env_int("RECORD_ARCHIVE_AFTER_MONTHS", 24, minimum=1)
+RECORD_PARTITIONS_AHEAD = _env_int("RECORD_PARTITIONS_AHEAD", 3, minimum=1) # Future months created in advance
+
+# --- Write-behind Scan Journal ---
+# When enabled, check-in/check-out scans that the in-memory state can answer are fsynced to a
+# local journal file and acknowledged at once; a background task applies them to the database
+# in batches (see app/scan_journal.py). Off by default: every scan is a synchronous commit.
+SCAN_JOURNAL_ENABLED = _env_flag("SCAN_JOURNAL_ENABLED", False)
+SCAN_JOURNAL_DIR = os.getenv("SCAN_JOURNAL_DIR", "journal")
+SCAN_JOURNAL_BATCH_SIZE = _env_int("SCAN_JOURNAL_BATCH_SIZE", 500, minimum=1)       # Scans per flush transaction
+SCAN_JOURNAL_FLUSH_MS = _env_int("SCAN_JOURNAL_FLUSH_MS", 200, minimum=1)            # Max delay before a flush
+SCAN_JOURNAL_LEASE_PLACES = _env_int("SCAN_JOURNAL_LEASE_PLACES", 10, minimum=1)    # Places a worker counts as occupied ahead of journaled check-ins
+SCAN_JOURNAL_PEER_WAIT_MS = _env_int("SCAN_JOURNAL_PEER_WAIT_MS", 5000)              # Wait for another worker's unapplied scan of the vehicle
+
+# --- Worker Startup ---
+# "dev": check for/create tables on boot. "production": skip schema introspection
+# (schema is managed by table_creation.txt / migrations) so workers start faster.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "dev").strip().lower()
+if STARTUP_MODE not in ("dev", "production"):
+    print(f"Warning: STARTUP_MODE ('{STARTUP_MODE}') is invalid. Using default: dev")
+    STARTUP_MODE = "dev"
+STARTUP_PREWARM_CONNECTIONS = _env_int("STARTUP_PREWARM_CONNECTIONS", 2) # Opened before serving; capped at DB_POOL_SIZE
 
 # Optional: Print loaded values for verification during startup (remove in production)
 # print(f"Loaded DATABASE_URL: {'Set' if DATABASE_URL else 'Not Set'}")
@@ -1,14 +1,23 @@
 # app/crud.py
 
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, update, and_, func
-from decimal import Decimal, ROUND_UP
+from sqlalchemy import select, update, and_, or_, case, literal, func, tuple_, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from decimal import Decimal
+import base64
 import datetime
+import heapq
+import itertools
+import json
+import os
 import pytz
 from fastapi import HTTPException, status
 
-from app import models, schemas, config
-from app.qr_code import generate_qr_code
+from app import models, schemas, config, rollups, partitions
+from app.qr_code import generate_qr_code, new_qr_data, parse_qr_data, qr_image_url
+from app.vehicle_cache import VehicleInfo, qr_cache
+from app.tariff import sql_fee
 
 # --- Owner CRUD (Unchanged) ---
 def get_owner_by_phone(db: Session, phone_number: str) -> models.Owner | None:
@@ -20,22 +29,121 @@ def create_owner(db: Session, owner_data: schemas.OwnerCreate) -> models.Owner:
     if existing_owner: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Owner with phone '{normalized_phone}' exists.")
     owner = models.Owner(name=normalized_name, phone_number=normalized_phone); db.add(owner); return owner
 
+# --- Lots ---
+def list_lots(db: Session) -> list[models.Lot]:
+    return db.scalars(select(models.Lot).order_by(models.Lot.id)).all()
+def create_lot(db: Session, lot_data: schemas.LotCreate) -> models.Lot:
+    name = lot_data.name.strip()
+    if not name: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Lot name required.")
+    if db.scalar(select(models.Lot.id).where(models.Lot.name == name)) is not None: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Lot '{name}' exists.")
+    lot = models.Lot(name=name, capacity=lot_data.capacity, occupied=0); db.add(lot); return lot
+def set_lot_capacity(db: Session, lot_id: int, capacity: int | None) -> models.Lot:
+    """Changes a lot's capacity. Lowering it below occupied only blocks new check-ins."""
+    lot = db.get(models.Lot, lot_id)
+    if not lot: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Lot {lot_id} not found.")
+    lot.capacity = capacity; return lot
+def recount_lot_occupancy(db) -> int:
+    """
+    Resets every lot's occupied counter to its number of open records (after a migration
+    or a manual data fix). Not for use while gates are busy: the count is a snapshot.
+    """
+    open_records = select(func.count()).select_from(models.ParkingRecord)\
+        .where(models.ParkingRecord.lot_id == models.Lot.id, models.ParkingRecord.exit_time.is_(None)).correlate(models.Lot).scalar_subquery()
+    return db.execute(update(models.Lot).values(occupied=open_records)).rowcount
+def lease_places(db: Session, lot_id: int, places: int) -> int:
+    """Counts up to places free places of a lot as occupied ahead of the check-ins that use them (scan journal). 0 when full or unknown."""
+    lot = models.Lot
+    free = select(lot.id, case((lot.capacity.is_(None), places), else_=func.least(places, lot.capacity - lot.occupied)).label("granted"))\
+        .where(lot.id == lot_id).with_for_update().cte("free")
+    return db.scalar(update(lot).where(lot.id == free.c.id, free.c.granted > 0).values(occupied=lot.occupied + free.c.granted)
+                     .returning(free.c.granted)) or 0
+def release_places(db: Session, places: dict[int, int]) -> None:
+    """Hands back leased places that no check-in used (lot_id -> places)."""
+    lot = models.Lot
+    for lot_id, count in places.items():
+        if count > 0: db.execute(update(lot).where(lot.id == lot_id).values(occupied=func.greatest(lot.occupied - count, 0)))
+
 # --- Vehicle CRUD (Register unchanged, get_vehicle modified) ---
 def get_vehicle_by_plate(db: Session, license_plate: str) -> models.Vehicle | None:
-    normalized_plate = license_plate.strip().upper(); return db.query(models.Vehicle).filter(func.upper(models.Vehicle.license_plate) == normalized_plate).first() if normalized_plate else None
+    normalized_plate = models.normalize_plate(license_plate); return db.query(models.Vehicle).filter(models.Vehicle.plate_normalized == normalized_plate).first() if normalized_plate else None
 def get_vehicle_by_qrcode(db: Session, qr_code: str) -> models.Vehicle | None:
     """Gets vehicle by QR code, eager loads Owner."""
     return db.query(models.Vehicle).options(joinedload(models.Vehicle.owner)).filter(models.Vehicle.qr_code == qr_code).first()
+def allocate_vehicle_ids(db: Session, count: int) -> list[int]:
+    """Reserves count vehicle ids from the vehicles id sequence, so signed QR codes can be built before the insert."""
+    return list(db.scalars(select(func.nextval("vehicles_id_seq")).select_from(func.generate_series(1, count))))
 def register_vehicle(db: Session, vehicle_data: schemas.VehicleCreate) -> tuple[models.Vehicle | None, str | None]:
+    """Registers a vehicle; returns it and the URL of its QR image."""
     normalized_plate = vehicle_data.license_plate.strip().upper(); owner_phone = vehicle_data.owner_phone_number.strip()
-    if not normalized_plate or not owner_phone: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Plate and Owner Phone required.")
+    if not models.normalize_plate(normalized_plate) or not owner_phone: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Plate and Owner Phone required.")
     if get_vehicle_by_plate(db, normalized_plate): raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Vehicle '{normalized_plate}' registered.")
     owner = get_owner_by_phone(db, owner_phone)
     if not owner: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Owner with phone '{owner_phone}' not found.")
-    qr_data, qr_file_path = generate_qr_code(normalized_plate)
-    if not qr_data or not qr_file_path: raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="QR generation failed.")
-    if get_vehicle_by_qrcode(db, qr_data): raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="QR collision.")
-    new_vehicle = models.Vehicle(license_plate=normalized_plate, qr_code=qr_data, owner_id=owner.id); db.add(new_vehicle); db.flush(); new_vehicle.owner = owner; return new_vehicle, qr_file_path
+    vehicle_id = allocate_vehicle_ids(db, 1)[0] if config.QR_SIGNING_KEY else None # Signed codes embed the id
+    if config.QR_CODE_STORAGE == "files":
+        qr_data, qr_file_path = generate_qr_code(normalized_plate, vehicle_id)
+        if not qr_data or not qr_file_path: raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="QR generation failed.")
+        qr_url = f"{config.QR_CODE_URL_PATH}/{os.path.basename(qr_file_path)}"
+    else:
+        qr_data = new_qr_data(normalized_plate, vehicle_id); qr_url = qr_image_url(qr_data) # Rendered on demand
+    if vehicle_id is None and get_vehicle_by_qrcode(db, qr_data): raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="QR collision.")
+    new_vehicle = models.Vehicle(id=vehicle_id, license_plate=normalized_plate, qr_code=qr_data, owner_id=owner.id); db.add(new_vehicle); db.flush(); new_vehicle.owner = owner
+    qr_cache.invalidate(qr_data); return new_vehicle, qr_url
+
+def search_vehicles(db: Session, query: str, limit: int = 20) -> list[dict]:
+    """
+    Finds vehicles by partial or misread plate, best matches first: prefix, then
+    substring, then trigram word-similarity (e.g. '12AB' or 'MH12A8'). Every branch
+    is served by the idx_vehicles_plate_trgm GIN index, which needs at least 3
+    characters (one trigram): shorter needles would scan the whole table.
+    """
+    needle = models.normalize_plate(query)
+    if len(needle) < 3: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Search needs at least 3 letters or digits.")
+    plate = models.Vehicle.plate_normalized
+    similarity = func.word_similarity(needle, plate)
+    match = case((plate.startswith(needle), literal("prefix")), (plate.contains(needle), literal("substring")), else_=literal("fuzzy"))
+    rank = case((plate.startswith(needle), 0), (plate.contains(needle), 1), else_=2)
+    rows = db.execute(select(models.Vehicle.id, models.Vehicle.license_plate, models.Owner.name, models.Owner.phone_number, match.label("match"), similarity.label("score"))
+                      .outerjoin(models.Owner, models.Vehicle.owner_id == models.Owner.id)
+                      .where(or_(plate.contains(needle), literal(needle).op("<%")(plate)))
+                      .order_by(rank, similarity.desc(), plate).limit(limit)).all()
+    return [{"id": r.id, "license_plate": r.license_plate, "owner_name": r.name, "owner_phone_number": r.phone_number,
+             "match": r.match, "score": round(float(r.score), 3)} for r in rows]
+
+# --- QR Resolution (cached) ---
+_vehicle_info_columns = (models.Vehicle.id, models.Vehicle.license_plate, models.Vehicle.owner_id,
+                         models.Owner.name, models.Owner.phone_number)
+
+def _qr_lookup(*conditions):
+    """(qr_code, *VehicleInfo) rows. Signed codes are looked up by primary key, legacy ones by the qr_code index."""
+    return (select(models.Vehicle.qr_code, *_vehicle_info_columns).outerjoin(models.Owner, models.Vehicle.owner_id == models.Owner.id)
+            .where(or_(*conditions)))
+
+def resolve_vehicle_by_qrcode(db: Session, qr_code: str) -> VehicleInfo | None:
+    """
+    Resolves a QR code to VehicleInfo, served from qr_cache when possible. Codes that fail
+    parse_qr_data (bad signature, unknown format) are rejected without a query. Misses are not cached.
+    """
+    parsed = parse_qr_data(qr_code)
+    if parsed is None: return None
+    info = qr_cache.get(qr_code)
+    if info is not None: return info
+    kind, vehicle_id = parsed
+    row = db.execute(_qr_lookup(models.Vehicle.id == vehicle_id if kind == "signed" else models.Vehicle.qr_code == qr_code)).first()
+    if not row or row.qr_code != qr_code: return None # A signed id whose vehicle has another code
+    info = VehicleInfo(*row[1:]); qr_cache.put(qr_code, info); return info
+
+def warm_vehicle_cache(db: Session) -> int:
+    """Pre-loads qr_cache from the vehicles table (up to its maxsize). Returns entries loaded."""
+    if qr_cache.maxsize <= 0: return 0
+    loaded = 0
+    rows = db.execute(select(models.Vehicle.qr_code, *_vehicle_info_columns)
+                      .outerjoin(models.Owner, models.Vehicle.owner_id == models.Owner.id)
+                      .order_by(models.Vehicle.id.desc()).limit(qr_cache.maxsize)
+                      .execution_options(yield_per=5000))
+    for qr_code, *fields in rows:
+        qr_cache.put(qr_code, VehicleInfo(*fields)); loaded += 1
+    return loaded
 
 # --- Parking Spot CRUD (REMOVED) ---
 # get_spot_by_number, update_spot_status, get_all_spots_with_status are removed
@@ -47,72 +155,279 @@ def get_active_record_by_vehicle_id(db: Session, vehicle_id: int) -> models.Park
              .options(joinedload(models.ParkingRecord.vehicle).joinedload(models.Vehicle.owner))\
              .filter(models.ParkingRecord.vehicle_id == vehicle_id, models.ParkingRecord.exit_time == None).first()
 
-def checkin_vehicle(db: Session, vehicle_id: int) -> models.ParkingRecord:
-    """Creates a parking record (no spot assignment)."""
-    # Assumes caller verified vehicle isn't already checked in
-    entry_time = datetime.datetime.now(pytz.utc)
-    db_record = models.ParkingRecord(vehicle_id=vehicle_id, entry_time=entry_time)
-    db.add(db_record)
-    # NO spot status update needed
-    return db_record
-
-def checkout_vehicle(db: Session, vehicle_id: int) -> dict | None:
-    """Finds active record, calculates fee, updates record."""
-    record = get_active_record_by_vehicle_id(db, vehicle_id) # Loads owner via vehicle
-    if not record: return None
-
-    exit_time = datetime.datetime.now(pytz.utc)
-    entry_time_aware = record.entry_time.astimezone(pytz.utc) if record.entry_time.tzinfo else pytz.utc.localize(record.entry_time)
-    duration = exit_time - entry_time_aware
-    duration_hours = Decimal(duration.total_seconds()) / Decimal(3600)
-    hours_charged = duration_hours.quantize(Decimal('1'), rounding=ROUND_UP)
-    fee = (hours_charged * config.PARKING_RATE_PER_HOUR).quantize(Decimal("0.01"))
-
-    record.exit_time = exit_time
-    record.fee = fee
-    # NO spot status update needed
-
-    owner_name_str = record.vehicle.owner.name if record.vehicle and record.vehicle.owner else "N/A"
-    owner_phone_str = record.vehicle.owner.phone_number if record.vehicle and record.vehicle.owner else "N/A"
+def _resolve_or_404(db: Session, qr_code: str) -> VehicleInfo:
+    info = resolve_vehicle_by_qrcode(db, qr_code)
+    if not info: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vehicle with QR code not found.")
+    return info
+
+def _open_record(db: Session, vehicle: VehicleInfo, entry_time: datetime.datetime, lot_id: int = models.DEFAULT_LOT_ID,
+                 preclaimed: bool = False) -> dict | None:
+    """
+    Claims a place in the lot and opens the record in one statement:
+      claimed   UPDATE lots SET occupied = occupied + 1 WHERE id = :lot AND (capacity IS NULL OR occupied < capacity)
+      inserted  INSERT ... SELECT FROM claimed ON CONFLICT DO NOTHING RETURNING
+    with the hourly rollup upsert attached as a CTE. None when the vehicle already
+    has an open record (the claim is handed back); 409 when the lot is full.
+
+    Only the lot's own counter row is locked, so gates of different lots never wait
+    on each other, and "full" is one row comparison rather than a count of records.
+    No conflict target: parking_records is partitioned, and the one-open-record
+    unique index lives on its default partition, where the new row is routed.
+    preclaimed: the place was already counted by lease_places (scan journal), so
+    claimed only selects the lot; it is still handed back when already checked in.
+    """
+    lot, record = models.Lot, models.ParkingRecord
+    if preclaimed: claimed = select(lot.id).where(lot.id == lot_id).cte("claimed")
+    else: claimed = update(lot).where(lot.id == lot_id, or_(lot.capacity.is_(None), lot.occupied < lot.capacity))\
+        .values(occupied=lot.occupied + 1).returning(lot.id).cte("claimed")
+    inserted = pg_insert(record).from_select(["vehicle_id", "lot_id", "entry_time"],
+                                             select(literal(vehicle.id), claimed.c.id, literal(entry_time, record.entry_time.type)))\
+        .on_conflict_do_nothing()\
+        .returning(record.id, record.entry_time).cte("inserted")
+    row = db.execute(select(claimed.c.id.label("lot_id"), inserted.c.id, inserted.c.entry_time)
+                     .select_from(claimed.outerjoin(inserted, true()))
+                     .add_cte(rollups.entry_cte(inserted, entry_time, lot_id))).first()
+    if row is None: # Nothing claimed: explain why (rare path, so the extra queries are fine)
+        if db.execute(select(record.id).where(record.vehicle_id == vehicle.id, record.exit_time.is_(None))).first(): return None
+        if db.scalar(select(lot.id).where(lot.id == lot_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Lot {lot_id} not found.")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Lot {lot_id} is full.")
+    if row.id is None: # Already checked in: give the place back (the lot row is already locked by us)
+        db.execute(update(lot).where(lot.id == lot_id).values(occupied=lot.occupied - 1))
+        return None
+    return {
+        "record_id": row.id,
+        "vehicle_id": vehicle.id,
+        "lot_id": lot_id,
+        "license_plate": vehicle.license_plate,
+        "owner_name": vehicle.owner_name or "N/A",
+        "owner_phone_number": vehicle.owner_phone_number or "N/A",
+        "entry_time": row.entry_time,
+    }
+
+def _moved_by_concurrent_update(exc: DBAPIError) -> bool:
+    """SQLSTATE 40001: the row this statement was about to update was moved to another partition meanwhile."""
+    return getattr(exc.orig, "sqlstate", None) == "40001"
+
+def _close_record(db: Session, vehicle: VehicleInfo, exit_time: datetime.datetime, savepoint: bool = False) -> dict | None:
+    """
+    Closes and prices the open record with a single statement (one round trip). None
+    when there is no open record that started at or before exit_time.
+
+    The UPDATE sets exit_time and the fee together: tariff.sql_fee computes it from
+    the record's entry_time and lot in SQL. Data-modifying CTEs on the same statement
+    release the lot's occupied counter and add the exit to the hourly rollup, locking
+    the lot row before the rollup row, in the same order as check-in.
+
+    Closing moves the row from parking_records_open to its exit month's partition, so
+    a concurrent close of the same record (two gates, or a batch/journal flush racing a
+    live scan) makes the second UPDATE fail with SQLSTATE 40001 instead of matching no
+    row. That is caught: the transaction (or, with savepoint=True, only this statement,
+    for callers that keep other work in the transaction) is rolled back and the open
+    record looked up again, so the outcome is None ("not checked in") as before.
+    """
+    lot, record = models.Lot, models.ParkingRecord
+    closed = update(record)\
+        .where(record.vehicle_id == vehicle.id, record.exit_time.is_(None), record.entry_time <= exit_time)\
+        .values(exit_time=exit_time, fee=sql_fee(record.entry_time, record.lot_id, exit_time))\
+        .returning(record.id, record.entry_time, record.lot_id, record.fee).cte("closed")
+    released = update(lot).where(lot.id == closed.c.lot_id, lot.occupied > 0).values(occupied=lot.occupied - 1)\
+        .returning(lot.id).cte("released")
+    statement = select(closed.c.id, closed.c.entry_time, closed.c.lot_id, closed.c.fee).add_cte(released).add_cte(rollups.exit_cte(closed, exit_time))
+    for attempt in range(2):
+        try:
+            if savepoint:
+                with db.begin_nested(): row = db.execute(statement).first()
+            else: row = db.execute(statement).first()
+            break
+        except DBAPIError as exc:
+            if not _moved_by_concurrent_update(exc): raise
+            if not savepoint: db.rollback()
+            still_open = db.scalar(select(record.id).where(record.vehicle_id == vehicle.id, record.exit_time.is_(None), record.entry_time <= exit_time))
+            if still_open is None or attempt: return None # Closed by the concurrent scan (retried once if checked in again meanwhile)
+    if not row: return None
+    fee = row.fee
+
+    entry_time_aware = row.entry_time.astimezone(pytz.utc) if row.entry_time.tzinfo else pytz.utc.localize(row.entry_time)
+    duration_hours = Decimal((exit_time - entry_time_aware).total_seconds()) / Decimal(3600)
 
     return {
-        "license_plate": record.vehicle.license_plate if record.vehicle else "N/A",
-        "owner_name": owner_name_str,
-        "owner_phone_number": owner_phone_str,
-        "entry_time": record.entry_time,
+        "record_id": row.id,
+        "vehicle_id": vehicle.id,
+        "lot_id": row.lot_id,
+        "license_plate": vehicle.license_plate,
+        "owner_name": vehicle.owner_name or "N/A",
+        "owner_phone_number": vehicle.owner_phone_number or "N/A",
+        "entry_time": row.entry_time,
         "exit_time": exit_time,
         "duration_hours": float(duration_hours.quantize(Decimal("0.001"))),
         "fee": float(fee)
     }
 
+def checkin_vehicle(db: Session, qr_code: str, lot_id: int = models.DEFAULT_LOT_ID) -> dict:
+    """
+    Checks a vehicle into a lot with a single statement (one round trip on a cache hit).
+
+    The QR code is resolved through qr_cache, then the lot place is claimed and the
+    record created by one statement (see _open_record). The unique partial index
+    uq_parking_records_one_active makes concurrent scans of the same vehicle
+    race-free: only one of them gets a record back.
+    """
+    vehicle = _resolve_or_404(db, qr_code)
+    record = _open_record(db, vehicle, datetime.datetime.now(pytz.utc), lot_id)
+    if not record: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Vehicle {vehicle.license_plate} is already checked in.")
+    return record
+
+def checkout_vehicle(db: Session, qr_code: str) -> dict:
+    """
+    Checks a vehicle out: closes the open record and prices the stay with the
+    tariff engine (see _close_record).
+    """
+    vehicle = _resolve_or_404(db, qr_code)
+    details = _close_record(db, vehicle, datetime.datetime.now(pytz.utc))
+    if not details: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Vehicle {vehicle.license_plate} is not currently checked in.")
+    return details
+
+# --- Batched Scan Events (gate replay) ---
+def resolve_vehicles_by_qrcodes(db: Session, qr_codes: set[str]) -> dict[str, VehicleInfo]:
+    """Resolves many QR codes: invalid ones are dropped, then cache, then all misses in a single query."""
+    resolved, signed_ids, legacy = {}, [], []
+    for qr in qr_codes:
+        parsed = parse_qr_data(qr)
+        if parsed is None: continue
+        info = qr_cache.get(qr)
+        if info is not None: resolved[qr] = info
+        elif parsed[0] == "signed": signed_ids.append(parsed[1])
+        else: legacy.append(qr)
+    conditions = ([models.Vehicle.id.in_(signed_ids)] if signed_ids else []) + ([models.Vehicle.qr_code.in_(legacy)] if legacy else [])
+    if conditions:
+        for qr, *fields in db.execute(_qr_lookup(*conditions)):
+            if qr in qr_codes: resolved[qr] = VehicleInfo(*fields); qr_cache.put(qr, resolved[qr])
+    return resolved
+
+def apply_scan_events(db: Session, events: list[schemas.ScanEvent], preclaimed: bool = False) -> list[dict]:
+    """
+    Applies ordered check-in/check-out events using their device timestamps.
+
+    All QR codes are resolved in one query and every event runs in the caller's
+    transaction (one commit for the whole batch). Rejected events are reported
+    per event rather than failing the batch. preclaimed: check-in places were
+    leased beforehand (see _open_record).
+    """
+    vehicles = resolve_vehicles_by_qrcodes(db, {event.qr_code for event in events})
+    results = []
+    for index, event in enumerate(events):
+        timestamp = event.timestamp if event.timestamp.tzinfo else pytz.utc.localize(event.timestamp)
+        result = {"index": index, "qr_code": event.qr_code, "action": event.action}
+        vehicle = vehicles.get(event.qr_code)
+        if not vehicle:
+            results.append({**result, "status_code": status.HTTP_404_NOT_FOUND, "message": "Vehicle with QR code not found."}); continue
+        if event.action == "checkin":
+            try: record = _open_record(db, vehicle, timestamp, event.lot_id, preclaimed)
+            except HTTPException as exc: # Lot full / unknown lot
+                results.append({**result, "license_plate": vehicle.license_plate, "lot_id": event.lot_id, "status_code": exc.status_code, "message": exc.detail}); continue
+            if record: results.append({**result, **record, "is_checked_in": True, "status_code": status.HTTP_200_OK, "message": f"Vehicle {vehicle.license_plate} checked IN."})
+            else: results.append({**result, "license_plate": vehicle.license_plate, "status_code": status.HTTP_400_BAD_REQUEST, "message": f"Vehicle {vehicle.license_plate} is already checked in."})
+        else:
+            details = _close_record(db, vehicle, timestamp, savepoint=True) # Earlier events share the transaction
+            if details: results.append({**result, **details, "is_checked_in": False, "status_code": status.HTTP_200_OK, "message": f"Vehicle {vehicle.license_plate} checked OUT."})
+            else: results.append({**result, "license_plate": vehicle.license_plate, "status_code": status.HTTP_400_BAD_REQUEST, "message": f"Vehicle {vehicle.license_plate} was not checked in at {timestamp.isoformat()}."})
+    return results
+
 # --- NEW: Get Vehicle Status ---
 def get_vehicle_status_by_qrcode(db: Session, qr_code: str) -> dict:
     """Gets vehicle details and current parking status by QR code."""
-    vehicle = get_vehicle_by_qrcode(db, qr_code=qr_code) # Loads owner
+    vehicle = resolve_vehicle_by_qrcode(db, qr_code=qr_code) # Cached QR -> vehicle/owner
     if not vehicle:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vehicle with scanned QR code not found.")
 
-    active_record = get_active_record_by_vehicle_id(db, vehicle_id=vehicle.id)
-
-    owner_name = vehicle.owner.name if vehicle.owner else "N/A"
-    owner_phone = vehicle.owner.phone_number if vehicle.owner else "N/A"
+    active = db.execute(select(models.ParkingRecord.entry_time, models.ParkingRecord.lot_id)
+                        .where(models.ParkingRecord.vehicle_id == vehicle.id, models.ParkingRecord.exit_time.is_(None))).first()
+    entry_time = active.entry_time if active else None
 
     status_info = {
         "message": "", # Set dynamically below
-        "is_checked_in": active_record is not None,
+        "is_checked_in": entry_time is not None,
         "license_plate": vehicle.license_plate,
-        "owner_name": owner_name,
-        "owner_phone_number": owner_phone,
-        "entry_time": active_record.entry_time if active_record else None,
+        "owner_name": vehicle.owner_name or "N/A",
+        "owner_phone_number": vehicle.owner_phone_number or "N/A",
+        "entry_time": entry_time,
         # Checkout specific fields initially null
         "exit_time": None,
         "duration_hours": None,
-        "fee": None
+        "fee": None,
+        "lot_id": active.lot_id if active else None
     }
 
-    if active_record:
-        status_info["message"] = f"Vehicle {vehicle.license_plate} is currently checked IN (since {active_record.entry_time.strftime('%Y-%m-%d %H:%M:%S %Z')})."
+    if entry_time is not None:
+        status_info["message"] = f"Vehicle {vehicle.license_plate} is currently checked IN (since {entry_time.strftime('%Y-%m-%d %H:%M:%S %Z')})."
     else:
         status_info["message"] = f"Vehicle {vehicle.license_plate} is currently checked OUT."
 
-    return status_info
\ No newline at end of file
+    return status_info
+
+# --- Parking History (keyset pagination + streaming export) ---
+_record_columns = (models.ParkingRecord.id, models.ParkingRecord.vehicle_id, models.ParkingRecord.lot_id, models.Vehicle.license_plate,
+                   models.ParkingRecord.entry_time, models.ParkingRecord.exit_time, models.ParkingRecord.fee)
+
+def encode_cursor(entry_time: datetime.datetime, record_id: int) -> str:
+    """Opaque cursor for the (entry_time, id) position of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps([entry_time.isoformat(), record_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        entry_time, record_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(entry_time), int(record_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+def _records_query(vehicle_id: int | None, start: datetime.datetime | None, end: datetime.datetime | None):
+    query = select(*_record_columns).join(models.Vehicle, models.ParkingRecord.vehicle_id == models.Vehicle.id)
+    if vehicle_id is not None: query = query.where(models.ParkingRecord.vehicle_id == vehicle_id)
+    if start is not None: query = query.where(models.ParkingRecord.entry_time >= start)
+    if end is not None: query = query.where(models.ParkingRecord.entry_time < end)
+    horizon = partitions.archive_horizon()
+    if horizon is not None: # Older exits are read from the archive files (see partitions)
+        query = query.where(or_(models.ParkingRecord.exit_time.is_(None), models.ParkingRecord.exit_time >= horizon))
+    return query
+
+def record_to_dict(row) -> dict:
+    return {"id": row.id, "vehicle_id": row.vehicle_id, "lot_id": row.lot_id, "license_plate": row.license_plate, "entry_time": row.entry_time,
+            "exit_time": row.exit_time, "fee": float(row.fee) if row.fee is not None else None}
+
+def list_parking_records(db: Session, vehicle_id: int | None = None, start: datetime.datetime | None = None,
+                         end: datetime.datetime | None = None, cursor: str | None = None, limit: int = 50) -> dict:
+    """
+    One page of records, newest entry first, with entry_time in [start, end).
+
+    Keyset pagination on (entry_time, id): each page is an index range scan that
+    starts where the previous one ended, so deep pages cost the same as the first.
+    Archived months are merged in with the same key; they are only opened when
+    they can hold rows newer than the last live row fetched.
+    """
+    query = _records_query(vehicle_id, start, end)
+    below = decode_cursor(cursor) if cursor else None
+    if below: query = query.where(tuple_(models.ParkingRecord.entry_time, models.ParkingRecord.id) < tuple_(*below))
+    rows = db.execute(query.order_by(models.ParkingRecord.entry_time.desc(), models.ParkingRecord.id.desc()).limit(limit + 1)).all()
+    if partitions.archive_horizon() is not None:
+        above = (rows[limit].entry_time, rows[limit].id) if len(rows) > limit else None
+        archived = partitions.archived_page(limit + 1, vehicle_id, start, end, below=below, above=above)
+        if archived: rows = heapq.nlargest(limit + 1, [*rows, *archived], key=lambda row: (row.entry_time, row.id))
+    next_cursor = encode_cursor(rows[limit - 1].entry_time, rows[limit - 1].id) if len(rows) > limit else None
+    return {"items": [record_to_dict(row) for row in rows[:limit]], "next_cursor": next_cursor}
+
+def get_vehicle_history(db: Session, license_plate: str, **page) -> dict:
+    """list_parking_records for one vehicle, looked up by plate."""
+    vehicle = get_vehicle_by_plate(db, license_plate)
+    if not vehicle: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vehicle '{license_plate.strip().upper()}' not found.")
+    return list_parking_records(db, vehicle_id=vehicle.id, **page)
+
+def iter_parking_records(db: Session, start: datetime.datetime | None = None, end: datetime.datetime | None = None,
+                         vehicle_id: int | None = None, chunk_size: int = 5000):
+    """Yields lists of record rows (oldest first) from a server-side cursor; memory stays at one chunk."""
+    result = db.execute(_records_query(vehicle_id, start, end).order_by(models.ParkingRecord.entry_time, models.ParkingRecord.id)
+                        .execution_options(yield_per=chunk_size))
+    if partitions.archive_horizon() is None: yield from result.partitions(); return
+    merged = heapq.merge(partitions.iter_archived(vehicle_id, start, end), (row for rows in result.partitions() for row in rows),
+                         key=lambda row: (row.entry_time, row.id))
+    while chunk := list(itertools.islice(merged, chunk_size)): yield chunk
@@ -1,17 +1,28 @@
 # app/database.py
 
-from sqlalchemy import create_engine
+import asyncio
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base # Updated import for SQLAlchemy 2.0+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 # Import the configuration
-from app import config
+from app import config, metrics
 
 # --- Database Connection Setup ---
-engine = create_engine(config.DATABASE_URL)
+_pool_options = dict(pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW, pool_timeout=config.DB_POOL_TIMEOUT,
+                     pool_recycle=config.DB_POOL_RECYCLE, pool_pre_ping=config.DB_POOL_PRE_PING)
+engine = create_engine(config.DATABASE_URL, poolclass=metrics.InstrumentedQueuePool, **_pool_options)
+metrics.instrument_engine(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# --- Async Connection Setup (config.USE_ASYNC_DB) ---
+# Only built when enabled so the sync fallback does not need the async driver.
+async_engine = create_async_engine(config.ASYNC_DATABASE_URL, poolclass=metrics.InstrumentedAsyncPool, **_pool_options) if config.USE_ASYNC_DB else None
+if async_engine is not None: metrics.instrument_engine(async_engine.sync_engine, "async")
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False) if async_engine else None
+
 # --- Dependency for FastAPI ---
 def get_db():
     """FastAPI dependency for database sessions."""
@@ -21,6 +32,50 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """FastAPI dependency for async database sessions."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_session():
+    """FastAPI dependency yielding an AsyncSession, or a sync Session when USE_ASYNC_DB is off."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await asyncio.to_thread(db.close)
+
+async def run_sync(db, fn, *args, **kwargs):
+    """
+    Runs fn(session, *args, **kwargs) without blocking the event loop.
+
+    With an AsyncSession, fn gets the underlying sync Session and every query is
+    awaited on the async driver (AsyncSession.run_sync), so the crud functions
+    serve both paths unchanged. With a sync Session, fn runs in a worker thread.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await asyncio.to_thread(fn, db, *args, **kwargs)
+
+async def run_in_new_session(fn, *args, **kwargs):
+    """Like run_sync, for background tasks that are not inside a request: opens its own session."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args, **kwargs)
+    def _run():
+        with SessionLocal() as db: return fn(db, *args, **kwargs)
+    return await asyncio.to_thread(_run)
+
+def pool_status() -> dict:
+    """Pool usage per engine, for /health."""
+    status = {"sync": metrics.pool_status(engine.pool, config.DB_MAX_OVERFLOW)}
+    if async_engine is not None: status["async"] = metrics.pool_status(async_engine.pool, config.DB_MAX_OVERFLOW)
+    return status
+
 # --- Optional: Function to Create Tables ---
 # Use migration tools (Alembic) for production.
 # Run manually once for development if needed: python -m app.database
@@ -29,7 +84,14 @@ def create_db_tables():
     print("Attempting to create database tables...")
     from app import models # Import models here
     try:
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn: conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm") # Plate search index
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn: # Lot 0 takes the check-ins that do not name a lot
+            conn.execute(text("INSERT INTO lots (id, name) VALUES (:id, 'Default') ON CONFLICT (id) DO NOTHING"), {"id": models.DEFAULT_LOT_ID})
+        if engine.dialect.name == "postgresql":
+            from app import partitions
+            with engine.begin() as conn: partitions.ensure_partitions(conn) # parking_records is partitioned by exit month
         print("Tables created successfully (or already existed).")
     except Exception as e:
         print(f"Error creating tables: {e}")
@@ -0,0 +1,101 @@
+# app/idempotency.py
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from app import config
+
+MUTATING_ACTIONS = ("checkin", "checkout")
+
+class _Entry:
+    __slots__ = ("expires", "future")
+    def __init__(self, expires: float, future: asyncio.Future):
+        self.expires, self.future = expires, future
+
+class ScanDeduplicator:
+    """
+    Absorbs repeated scans: the first request for (qr_code, action[, variant][, Idempotency-Key])
+    runs (variant distinguishes requests of one action that must not share an answer,
+    e.g. check-ins at different lots), and repeats within the window get its result (or its 4xx error) from memory,
+    without touching the database. Repeats that arrive while the first is still
+    running wait for it instead of racing it.
+
+    A successful check-in/check-out drops the window results of the other actions for
+    that QR code, so a status scan or the opposite action right after it is not stale.
+    Results stored under an Idempotency-Key are kept for their TTL: a late retry with
+    the key must get the original answer, not run again.
+    Runs on the event loop only (endpoints are async), so no locking is needed.
+    """
+
+    def __init__(self, window_seconds: int, key_ttl_seconds: int, max_codes: int):
+        self.window_seconds = window_seconds
+        self.key_ttl_seconds = key_ttl_seconds
+        self.max_codes = max_codes
+        self._entries: OrderedDict[str, dict[tuple, _Entry]] = OrderedDict() # qr_code -> {(action, key, variant): entry}
+        self.executed = 0
+        self.absorbed = 0
+        self.joined_in_flight = 0
+
+    async def run(self, qr_code: str, action: str, idempotency_key: str | None, execute, variant=None):
+        """Returns (result, deduplicated). execute is a zero-argument coroutine function."""
+        ttl = self.key_ttl_seconds if idempotency_key else self.window_seconds
+        if ttl <= 0:
+            self.executed += 1
+            return await execute(), False
+        now = time.monotonic()
+        slot = (action, idempotency_key, variant)
+        entries = self._entries.get(qr_code)
+        entry = entries.get(slot) if entries else None
+        if entry is not None and (entry.expires > now or not entry.future.done()):
+            if entry.future.done(): self.absorbed += 1
+            else: self.joined_in_flight += 1
+            return _unwrap(await asyncio.shield(entry.future)), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._store(qr_code, slot, _Entry(now + ttl, future))
+        self.executed += 1
+        try:
+            result = await execute()
+        except HTTPException as exc:
+            if exc.status_code >= 500: self._discard(qr_code, slot) # Only remember definite answers
+            future.set_result(exc); raise
+        except BaseException as exc:
+            self._discard(qr_code, slot); future.set_result(exc); raise
+        if action in MUTATING_ACTIONS: self._drop_others(qr_code, action)
+        future.set_result(result)
+        return result, False
+
+    def invalidate(self, qr_code: str) -> None:
+        """Forgets the window results cached for a QR code (e.g. after a batched scan); keyed results stay."""
+        entries = self._entries.get(qr_code)
+        if entries:
+            for slot in [slot for slot in entries if slot[1] is None]: del entries[slot]
+
+    def _store(self, qr_code: str, slot: tuple, entry: _Entry) -> None:
+        self._entries.setdefault(qr_code, {})[slot] = entry
+        self._entries.move_to_end(qr_code)
+        while len(self._entries) > self.max_codes: self._entries.popitem(last=False)
+
+    def _discard(self, qr_code: str, slot: tuple) -> None:
+        entries = self._entries.get(qr_code)
+        if entries: entries.pop(slot, None)
+
+    def _drop_others(self, qr_code: str, action: str) -> None:
+        entries = self._entries.get(qr_code)
+        if entries:
+            for slot in [slot for slot in entries if slot[0] != action and slot[1] is None]: del entries[slot]
+
+    def stats(self) -> dict:
+        return {"window_seconds": self.window_seconds, "tracked_codes": len(self._entries), "executed": self.executed,
+                "absorbed": self.absorbed, "joined_in_flight": self.joined_in_flight}
+
+def _unwrap(outcome):
+    if isinstance(outcome, HTTPException): raise HTTPException(status_code=outcome.status_code, detail=outcome.detail, headers=outcome.headers)
+    if isinstance(outcome, BaseException): raise outcome
+    return outcome
+
+# Process-wide instance
+scan_dedup = ScanDeduplicator(config.SCAN_DEDUP_WINDOW_SECONDS, config.IDEMPOTENCY_KEY_TTL_SECONDS, config.SCAN_DEDUP_MAX_ENTRIES)
@@ -1,136 +1,319 @@
 # app/main.py
 
+import time
+_IMPORT_STARTED = time.perf_counter() # Cold-start timing (see startup_timings)
+
 import os
-from fastapi import FastAPI, Depends, HTTPException, Request, status
-from fastapi.responses import HTMLResponse
+import io
+import csv
+import json
+import asyncio
+import datetime
+import hashlib
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Query, status
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Dict # Import Dict
 
-from app import crud, models, schemas, database, config
+from app import crud, models, schemas, database, config, bulk_import, rollups, metrics, partitions, responses
+from app.qr_code import QR_IMAGE_MEDIA_TYPES, render_qr
+from app.vehicle_cache import qr_cache
+from app.occupancy import tracker as occupancy
+from app.idempotency import scan_dedup
+from app.scan_journal import scan_journal
+from app.tariff import get_tariff
+import pytz
 
 # --- App, Middleware, Static Files, Templates (Unchanged) ---
-app = FastAPI(title="QR Vehicle Status System")
+app = FastAPI(title="QR Vehicle Status System", default_response_class=responses.FastJSONResponse)
 origins = ["*"]
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(metrics.RequestMetricsMiddleware) # Per-endpoint latency for /metrics
 app.mount("/static", StaticFiles(directory="static"), name="static")
+os.makedirs(config.QR_CODE_DIR, exist_ok=True) # Legacy PNGs (QR_CODE_STORAGE=files and older links)
 app.mount(config.QR_CODE_URL_PATH, StaticFiles(directory=config.QR_CODE_DIR), name="qrcodes")
 templates = Jinja2Templates(directory="templates")
 
-# --- Database Initialization (Unchanged) ---
-@app.on_event("startup")
-def on_startup(): # Keep startup event as before
+startup_timings: dict[str, float] = {"app_import_seconds": 0.0}
+
+def _timed_step(name: str, step) -> None:
+    """Runs one startup step, recording its duration and printing (not raising) its errors."""
+    started = time.perf_counter()
+    try: step()
+    except Exception as e: print(f"Startup step '{name}' failed: {e}")
+    startup_timings[f"{name}_seconds"] = round(time.perf_counter() - started, 4)
+
+def _check_schema():
+    from sqlalchemy import inspect
+    inspector = inspect(database.engine)
+    if not inspector.has_table("vehicles"): print("DB tables not found, creating..."); database.create_db_tables()
+    else:
+        print("DB tables already exist.")
+        with database.engine.begin() as conn: # Production runs `python -m app.partitions ensure` monthly instead
+            created = partitions.ensure_partitions(conn)
+        if created: print(f"Created parking_records partitions: {created}")
+
+async def _prewarm_pool():
+    """Opens STARTUP_PREWARM_CONNECTIONS connections up front so the first scans skip connection setup."""
+    count = min(config.STARTUP_PREWARM_CONNECTIONS, config.DB_POOL_SIZE)
+    started = time.perf_counter()
     try:
-        from sqlalchemy import inspect
-        inspector = inspect(database.engine)
-        if not inspector.has_table("vehicles"): print("DB tables not found, creating..."); database.create_db_tables()
-        else: print("DB tables already exist.")
-    except Exception as e: print(f"DB check/creation error: {e}")
+        if database.async_engine is not None:
+            connections = await asyncio.gather(*(database.async_engine.connect() for _ in range(count)))
+            for connection in connections: await connection.close() # Back to the pool, still open
+        else:
+            connections = [database.engine.connect() for _ in range(count)]
+            for connection in connections: connection.close()
+    except Exception as e: print(f"Startup step 'pool_prewarm' failed: {e}")
+    startup_timings["pool_prewarm_seconds"] = round(time.perf_counter() - started, 4)
+
+def _warm_qr_cache():
+    with database.SessionLocal() as db: print(f"QR cache pre-warmed with {crud.warm_vehicle_cache(db)} vehicles.")
+
+def _load_occupancy():
+    with database.SessionLocal() as db: print(f"Occupancy snapshot: {occupancy.load_snapshot(db)} vehicles inside.")
+
+# --- Startup ---
+@app.on_event("startup")
+async def on_startup():
+    started = time.perf_counter()
+    # Schema is managed by migrations in production; introspection only runs in dev mode
+    if config.STARTUP_MODE == "dev": _timed_step("schema_check", _check_schema)
+    await _prewarm_pool()
+    _timed_step("template_prewarm", lambda: templates.get_template("index.html")) # Compile once, before the first page view
+    if config.QR_CACHE_PREWARM: _timed_step("qr_cache_prewarm", _warm_qr_cache)
+    if config.SCAN_JOURNAL_ENABLED:
+        journal_started = time.perf_counter()
+        try: await scan_journal.start() # Replays journals left by dead workers before the snapshot below
+        except Exception as e: print(f"Startup step 'scan_journal' failed, scans commit synchronously: {e}")
+        startup_timings["scan_journal_seconds"] = round(time.perf_counter() - journal_started, 4)
+    _timed_step("occupancy_snapshot", _load_occupancy)
+    if config.OCCUPANCY_RESYNC_SECONDS: app.state.occupancy_resync = asyncio.get_running_loop().create_task(_resync_occupancy())
+    startup_timings["startup_seconds"] = round(time.perf_counter() - started, 4)
+    print(f"Worker ready ({config.STARTUP_MODE} mode): {startup_timings}")
+
+async def _resync_occupancy():
+    """Periodically re-reads the open records so scans handled by other workers are reflected."""
+    while True:
+        await asyncio.sleep(config.OCCUPANCY_RESYNC_SECONDS)
+        try:
+            # The database does not show journaled scans until applied: lay this worker's over it
+            if scan_journal.running: occupancy.replace(await scan_journal.overlay(occupancy.read_sessions))
+            else: await database.run_in_new_session(occupancy.load_snapshot)
+        except Exception as e: print(f"Occupancy resync error: {e}")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if scan_journal.running: await scan_journal.stop() # Applies what it can before the engine goes
+    if database.async_engine is not None: await database.async_engine.dispose()
 
 # --- API Endpoints ---
 
-# Owner Registration (Unchanged)
-@app.post("/api/owners", response_model=schemas.Owner, status_code=status.HTTP_201_CREATED)
-async def register_new_owner(owner_data: schemas.OwnerCreate, db: Session = Depends(database.get_db)):
+# Each endpoint awaits a sync unit of work through database.run_sync: on the async
+# path (config.USE_ASYNC_DB) its queries are awaited on the AsyncSession's driver,
+# on the sync fallback it runs in a worker thread. Either way the loop never blocks.
+
+# Owner Registration
+def _register_owner(db: Session, owner_data: schemas.OwnerCreate) -> models.Owner:
     try: owner = crud.create_owner(db=db, owner_data=owner_data); db.commit(); db.refresh(owner); return owner
     except HTTPException as http_exc: db.rollback(); raise http_exc
     except Exception as e: db.rollback(); print(f"Error owner reg: {e}"); raise HTTPException(status_code=500)
 
-# Vehicle Registration (Unchanged)
-@app.post("/api/register", response_model=schemas.VehicleRegistrationResponse, status_code=status.HTTP_201_CREATED)
-async def register_new_vehicle(vehicle_data: schemas.VehicleCreate, db: Session = Depends(database.get_db)):
+@app.post("/api/owners", response_model=schemas.Owner, status_code=status.HTTP_201_CREATED)
+async def register_new_owner(owner_data: schemas.OwnerCreate, db = Depends(database.get_session)):
+    return await database.run_sync(db, _register_owner, owner_data)
+
+# Vehicle Registration
+def _register_vehicle(db: Session, vehicle_data: schemas.VehicleCreate) -> schemas.VehicleRegistrationResponse:
     try:
-        vehicle, qr_path = crud.register_vehicle(db=db, vehicle_data=vehicle_data); db.commit(); db.refresh(vehicle)
+        vehicle, qr_url = crud.register_vehicle(db=db, vehicle_data=vehicle_data); db.commit(); db.refresh(vehicle)
         # Ensure owner relationship is loaded for response if needed (crud should handle via flush)
         # if not vehicle.owner: db.refresh(vehicle.owner) # Might not be needed
     except HTTPException as http_exc: db.rollback(); raise http_exc
     except Exception as e: db.rollback(); print(f"Error vehicle reg: {e}"); raise HTTPException(status_code=500)
-    relative_qr_url = f"{config.QR_CODE_URL_PATH}/{os.path.basename(qr_path)}"
     response_vehicle_schema = schemas.Vehicle.model_validate(vehicle)
-    return schemas.VehicleRegistrationResponse(vehicle=response_vehicle_schema, qr_code_path=relative_qr_url, message=f"Vehicle '{vehicle.license_plate}' registered for owner phone '{vehicle_data.owner_phone_number}'.")
+    return schemas.VehicleRegistrationResponse(vehicle=response_vehicle_schema, qr_code_path=qr_url, message=f"Vehicle '{vehicle.license_plate}' registered for owner phone '{vehicle_data.owner_phone_number}'.")
+
+@app.post("/api/register", response_model=schemas.VehicleRegistrationResponse, status_code=status.HTTP_201_CREATED)
+async def register_new_vehicle(vehicle_data: schemas.VehicleCreate, db = Depends(database.get_session)):
+    return await database.run_sync(db, _register_vehicle, vehicle_data)
+
+# Bulk Import: raw CSV / NDJSON / JSON request body, streamed into app.bulk_import
+@app.post("/api/import")
+async def import_owners_and_vehicles(request: Request, format: str | None = None, render_qr: bool | None = None):
+    """Bulk-registers owners/vehicles; returns counts and per-row errors."""
+    fmt = format or bulk_import.format_from_content_type(request.headers.get("content-type"))
+    if fmt not in bulk_import.FORMATS: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported format '{fmt}'.")
+    body = io.BufferedReader(bulk_import.AsyncBodyReader(request.stream(), asyncio.get_running_loop()))
+    return await asyncio.to_thread(bulk_import.run_import, body, fmt, render_qr=render_qr)
+
+# QR Images: rendered on demand from the stored Vehicle.qr_code
+@app.get("/api/qr/{filename}")
+async def get_qr_image(filename: str, request: Request, db = Depends(database.get_session)):
+    """Serves a vehicle's QR code as {qr_code}.png or {qr_code}.svg."""
+    qr_data, _, fmt = filename.rpartition(".")
+    if fmt not in QR_IMAGE_MEDIA_TYPES or not qr_data: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown QR image.")
+    etag = '"' + hashlib.sha1(f"{qr_data}.{fmt}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    # Existence first (a qr_cache hit), so a stale ETag of an unknown code still gets 404
+    if not await database.run_sync(db, crud.resolve_vehicle_by_qrcode, qr_data): raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vehicle with QR code not found.")
+    if request.headers.get("if-none-match") == etag: return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    image = await asyncio.to_thread(render_qr, qr_data, fmt)
+    return Response(content=image, media_type=QR_IMAGE_MEDIA_TYPES[fmt], headers=headers)
+
+# --- Lots ---
+def _commit_lot(db: Session, change, *args) -> models.Lot:
+    try: lot = change(db, *args); db.commit(); db.refresh(lot); return lot
+    except HTTPException as http_exc: db.rollback(); raise http_exc
+    except Exception as e: db.rollback(); print(f"Error saving lot: {e}"); raise HTTPException(status_code=500)
+
+@app.get("/api/lots", response_model=List[schemas.Lot])
+async def list_lots(db = Depends(database.get_session)):
+    """Lots with their capacity and current occupied counter (shared by all workers)."""
+    return await database.run_sync(db, crud.list_lots)
+
+@app.post("/api/lots", response_model=schemas.Lot, status_code=status.HTTP_201_CREATED)
+async def create_lot(lot_data: schemas.LotCreate, db = Depends(database.get_session)):
+    return await database.run_sync(db, _commit_lot, crud.create_lot, lot_data)
+
+@app.patch("/api/lots/{lot_id}", response_model=schemas.Lot)
+async def update_lot(lot_id: int, lot_data: schemas.LotUpdate, db = Depends(database.get_session)):
+    return await database.run_sync(db, _commit_lot, crud.set_lot_capacity, lot_id, lot_data.capacity)
+
+# --- Scan Deduplication (repeated reads of the same QR code) ---
+async def _deduplicated(qr_code: str, action: str, idempotency_key: str | None, execute, variant=None) -> Response:
+    """Runs execute() once per (qr_code, action[, variant][, Idempotency-Key]) window; repeats are answered from memory."""
+    body, deduplicated = await scan_dedup.run(qr_code, action, idempotency_key, execute, variant)
+    return responses.json_response(body, headers={"X-Scan-Deduplicated": "true"} if deduplicated else None)
+
+# --- Write-behind Scan Journal (config.SCAN_JOURNAL_ENABLED) ---
+async def _synchronous(db, qr_code: str, commit, *args) -> bytes:
+    """
+    The synchronous path of a journaled endpoint. This worker's pending scans of the
+    vehicle are applied first; a rejection (400) is retried once another worker's
+    unapplied scans of it are in the database (503 if they stay pending).
+    """
+    if scan_journal.has_pending(qr_code): await scan_journal.flush() # Keep this vehicle's scans in order
+    try: return await database.run_sync(db, commit, qr_code, *args)
+    except HTTPException as exc:
+        if exc.status_code != status.HTTP_400_BAD_REQUEST: raise
+        try:
+            if not await scan_journal.wait_for_peers(qr_code, config.SCAN_JOURNAL_PEER_WAIT_MS / 1000): raise exc
+        except TimeoutError as e:
+            print(f"Scan journal: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="A previous scan of this vehicle is still being saved. Please scan again.")
+    return await database.run_sync(db, commit, qr_code, *args)
+
+async def _journaled(db, qr_code: str, action: str, lot_id: int = models.DEFAULT_LOT_ID) -> bytes | None:
+    """
+    Answers a check-in/check-out from memory and appends it to the scan journal
+    (applied to the database by the background flusher). None when memory cannot
+    decide safely, and the synchronous path runs instead: journal not running,
+    unknown QR code, vehicle state that disagrees with the scan, no place left to
+    lease in the lot (full or unknown), or a journal/database error.
+    """
+    if not scan_journal.running: return None # start() failed (see startup log): every scan commits synchronously
+    vehicle = await database.run_sync(db, crud.resolve_vehicle_by_qrcode, qr_code) # Cache hit: no database access
+    if not vehicle: return None
+    session, now = occupancy.session_of(vehicle.id), datetime.datetime.now(pytz.utc)
+    fields = dict(license_plate=vehicle.license_plate, owner_name=vehicle.owner_name or "N/A", owner_phone_number=vehicle.owner_phone_number or "N/A")
+    if action == "checkin" and session is not None: return None
+    if action == "checkout" and session is None: return None
+    try:
+        if action == "checkin" and not await scan_journal.take_place(lot_id): return None # Full or unknown: the sync path answers 409/404
+    except Exception as e: print(f"Scan journal lease failed, committing synchronously: {e}"); return None
+    try: await scan_journal.append(qr_code, action, now, lot_id if action == "checkin" else session["lot_id"], vehicle.id, vehicle.license_plate)
+    except Exception as e:
+        if action == "checkin": scan_journal.give_back(lot_id)
+        print(f"Scan journal append failed, committing synchronously: {e}"); return None
+    if action == "checkin":
+        occupancy.checked_in({"record_id": None, "vehicle_id": vehicle.id, "lot_id": lot_id, "license_plate": vehicle.license_plate, "entry_time": now})
+        return responses.status_body(message=f"Vehicle {vehicle.license_plate} checked IN successfully.", is_checked_in=True, entry_time=now, lot_id=lot_id, **fields)
+    # Same pricing the flusher will apply: tariff of the session's lot from its entry_time
+    fee = get_tariff(session["lot_id"]).price(session["entry_time"], now)
+    duration_hours = round((now - session["entry_time"]).total_seconds() / 3600, 3)
+    details = {"record_id": session["record_id"], "vehicle_id": vehicle.id, "lot_id": session["lot_id"], "license_plate": vehicle.license_plate,
+               "exit_time": now, "fee": float(fee)}
+    occupancy.checked_out(details)
+    return responses.status_body(message=f"Vehicle {vehicle.license_plate} checked OUT successfully.", is_checked_in=False, entry_time=session["entry_time"],
+                        exit_time=now, duration_hours=duration_hours, fee=float(fee), lot_id=session["lot_id"], **fields)
 
 # --- Spots Endpoint REMOVED ---
 # @app.get("/api/spots", ...) removed
 
-# --- NEW: Vehicle Status Endpoint ---
+# --- Vehicle Status Endpoint ---
 @app.post("/api/vehicle-status", response_model=schemas.VehicleStatusResponse)
 async def get_vehicle_status(
     # Use a simple schema for the request body
     request_data: schemas.CheckOutRequest, # Reusing CheckOutRequest as it just needs qr_code
-    db: Session = Depends(database.get_db)
+    idempotency_key: str | None = Header(None),
+    db = Depends(database.get_session)
 ):
     """Gets the current status (checked-in/out) and details of a vehicle by QR code."""
-    try:
-        status_details = crud.get_vehicle_status_by_qrcode(db=db, qr_code=request_data.qr_code)
-        # Directly return the dict which should match the Pydantic model
-        return status_details
-    except HTTPException as http_exc:
-        raise http_exc # Re-raise HTTP exceptions from CRUD
-    except Exception as e:
-        print(f"Error getting vehicle status: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal error getting vehicle status.")
-
-
-# --- MODIFIED: Check-in Endpoint ---
-@app.post("/api/checkin", response_model=schemas.VehicleStatusResponse)
-async def check_in_vehicle(
-    # Request now only contains qr_code
-    check_in_data: schemas.CheckInRequest,
-    db: Session = Depends(database.get_db)
-):
-    """Checks a vehicle IN using QR code."""
-    vehicle = crud.get_vehicle_by_qrcode(db, qr_code=check_in_data.qr_code) # Loads owner
-    if not vehicle: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vehicle with QR code not found.")
+    async def lookup():
+        try:
+            return responses.status_body(**await database.run_sync(db, crud.get_vehicle_status_by_qrcode, qr_code=request_data.qr_code))
+        except HTTPException as http_exc:
+            raise http_exc # Re-raise HTTP exceptions from CRUD
+        except Exception as e:
+            print(f"Error getting vehicle status: {e}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal error getting vehicle status.")
+    return await _deduplicated(request_data.qr_code, "vehicle-status", idempotency_key, lookup)
 
-    active_record = crud.get_active_record_by_vehicle_id(db, vehicle_id=vehicle.id)
-    if active_record: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Vehicle {vehicle.license_plate} is already checked in.")
-
-    # --- Spot lookup/check REMOVED ---
 
+# --- Check-in Endpoint ---
+def _check_in(db: Session, qr_code: str, lot_id: int) -> bytes:
     try:
-        record = crud.checkin_vehicle(db=db, vehicle_id=vehicle.id) # No spot_id needed
-        db.commit(); db.refresh(record)
-        db.refresh(record.vehicle);
-        if record.vehicle: db.refresh(record.vehicle.owner) # Ensure owner loaded
+        record = crud.checkin_vehicle(db=db, qr_code=qr_code, lot_id=lot_id) # Single statement, race-free
+        db.commit()
+    except HTTPException as http_exc:
+        db.rollback(); raise http_exc
     except Exception as e:
         db.rollback(); print(f"Error check-in commit: {e}"); raise HTTPException(status_code=500)
+    occupancy.checked_in(record)
 
-    owner_name = record.vehicle.owner.name if record.vehicle and record.vehicle.owner else "N/A"
-    owner_phone = record.vehicle.owner.phone_number if record.vehicle and record.vehicle.owner else "N/A"
-
-    return schemas.VehicleStatusResponse(
-        message=f"Vehicle {vehicle.license_plate} checked IN successfully.",
+    return responses.status_body(
+        message=f"Vehicle {record['license_plate']} checked IN successfully.",
         is_checked_in=True,
-        license_plate=vehicle.license_plate,
-        owner_name=owner_name,
-        owner_phone_number=owner_phone,
-        entry_time=record.entry_time
+        license_plate=record['license_plate'],
+        owner_name=record['owner_name'],
+        owner_phone_number=record['owner_phone_number'],
+        entry_time=record['entry_time'],
+        lot_id=record['lot_id']
     )
 
-# --- MODIFIED: Check-out Endpoint ---
-@app.post("/api/checkout", response_model=schemas.VehicleStatusResponse) # Changed response model
-async def check_out_vehicle(
-    check_out_data: schemas.CheckOutRequest,
-    db: Session = Depends(database.get_db)
+@app.post("/api/checkin", response_model=schemas.VehicleStatusResponse)
+async def check_in_vehicle(
+    # Request now only contains qr_code
+    check_in_data: schemas.CheckInRequest,
+    idempotency_key: str | None = Header(None),
+    db = Depends(database.get_session)
 ):
-    """Checks out a vehicle using its QR code."""
-    vehicle = crud.get_vehicle_by_qrcode(db, qr_code=check_out_data.qr_code) # Loads owner
-    if not vehicle: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vehicle with QR code not found.")
+    """Checks a vehicle IN using QR code, at lot_id (409 when the lot is full)."""
+    async def execute():
+        if config.SCAN_JOURNAL_ENABLED:
+            body = await _journaled(db, check_in_data.qr_code, "checkin", check_in_data.lot_id)
+            if body is not None: return body
+            return await _synchronous(db, check_in_data.qr_code, _check_in, check_in_data.lot_id)
+        return await database.run_sync(db, _check_in, check_in_data.qr_code, check_in_data.lot_id)
+    return await _deduplicated(check_in_data.qr_code, "checkin", idempotency_key, execute, variant=check_in_data.lot_id)
 
+# --- Check-out Endpoint ---
+def _check_out(db: Session, qr_code: str) -> bytes:
     try:
-        checkout_details = crud.checkout_vehicle(db=db, vehicle_id=vehicle.id)
-        if not checkout_details:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Vehicle {vehicle.license_plate} is not currently checked in.")
+        checkout_details = crud.checkout_vehicle(db=db, qr_code=qr_code) # Single statement
         db.commit()
     except HTTPException as http_exc:
          db.rollback(); raise http_exc
     except Exception as e:
         db.rollback(); print(f"Error check-out commit: {e}"); raise HTTPException(status_code=500)
+    occupancy.checked_out(checkout_details)
 
     # Use the details returned from crud function
-    return schemas.VehicleStatusResponse(
+    return responses.status_body(
         message=f"Vehicle {checkout_details['license_plate']} checked OUT successfully.",
         is_checked_in=False,
         license_plate=checkout_details['license_plate'],
@@ -139,11 +322,138 @@ async def check_out_vehicle(
         entry_time=checkout_details['entry_time'],
         exit_time=checkout_details['exit_time'],
         duration_hours=checkout_details['duration_hours'],
-        fee=checkout_details['fee']
+        fee=checkout_details['fee'],
+        lot_id=checkout_details['lot_id']
     )
 
+@app.post("/api/checkout", response_model=schemas.VehicleStatusResponse) # Changed response model
+async def check_out_vehicle(
+    check_out_data: schemas.CheckOutRequest,
+    idempotency_key: str | None = Header(None),
+    db = Depends(database.get_session)
+):
+    """Checks out a vehicle using its QR code."""
+    async def execute():
+        if config.SCAN_JOURNAL_ENABLED:
+            body = await _journaled(db, check_out_data.qr_code, "checkout")
+            if body is not None: return body
+            return await _synchronous(db, check_out_data.qr_code, _check_out)
+        return await database.run_sync(db, _check_out, check_out_data.qr_code)
+    return await _deduplicated(check_out_data.qr_code, "checkout", idempotency_key, execute)
+
+# --- Batched Scan Events (gate replay after an outage) ---
+def _apply_events(db: Session, events: list[schemas.ScanEvent]) -> schemas.ScanEventBatchResponse:
+    try:
+        results = crud.apply_scan_events(db=db, events=events) # One transaction for the batch
+        db.commit()
+    except Exception as e:
+        db.rollback(); print(f"Error applying scan events: {e}"); raise HTTPException(status_code=500)
+    for r in results:
+        if r["status_code"] == status.HTTP_200_OK: (occupancy.checked_in if r["action"] == "checkin" else occupancy.checked_out)(r)
+    applied = sum(1 for r in results if r["status_code"] == status.HTTP_200_OK)
+    return schemas.ScanEventBatchResponse(applied=applied, rejected=len(results) - applied, results=results)
+
+@app.post("/api/events/batch", response_model=schemas.ScanEventBatchResponse)
+async def ingest_scan_events(batch: schemas.ScanEventBatchRequest, db = Depends(database.get_session)):
+    """Applies an ordered batch of gate scans with their device timestamps in a single transaction."""
+    result = await database.run_sync(db, _apply_events, batch.events)
+    for qr in {event.qr_code for event in batch.events}: scan_dedup.invalidate(qr)
+    return result
+
+# --- Plate Search (damaged / unreadable QR stickers) ---
+@app.get("/api/vehicles/search")
+async def search_vehicles(q: str = Query(..., min_length=3, max_length=20), limit: int = Query(20, ge=1, le=100), db = Depends(database.get_session)):
+    """Prefix, substring and fuzzy plate matches, best first."""
+    return await database.run_sync(db, crud.search_vehicles, q, limit=limit)
+
+# --- Parking History (keyset pagination) & Export ---
+@app.get("/api/vehicles/{license_plate}/history", response_model=schemas.ParkingRecordPage)
+async def get_vehicle_history(license_plate: str, start: datetime.datetime | None = None, end: datetime.datetime | None = None,
+                              cursor: str | None = None, limit: int = Query(50, ge=1, le=500), db = Depends(database.get_session)):
+    """A vehicle's parking records, newest first. Follow next_cursor for older pages."""
+    return await database.run_sync(db, crud.get_vehicle_history, license_plate, start=start, end=end, cursor=cursor, limit=limit)
+
+@app.get("/api/records", response_model=schemas.ParkingRecordPage)
+async def list_records(start: datetime.datetime | None = None, end: datetime.datetime | None = None,
+                       cursor: str | None = None, limit: int = Query(50, ge=1, le=500), db = Depends(database.get_session)):
+    """All parking records with entry_time in [start, end), newest first."""
+    return await database.run_sync(db, crud.list_parking_records, start=start, end=end, cursor=cursor, limit=limit)
+
+_EXPORT_FIELDS = ["id", "vehicle_id", "lot_id", "license_plate", "entry_time", "exit_time", "fee"]
+
+def _export_records(fmt: str, start: datetime.datetime | None, end: datetime.datetime | None):
+    """Sync generator (run by Starlette in a worker thread): one encoded chunk per server-side cursor batch."""
+    with database.SessionLocal() as db:
+        if fmt == "csv": yield ",".join(_EXPORT_FIELDS) + "\r\n"
+        for rows in crud.iter_parking_records(db, start=start, end=end):
+            buffer = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                writer.writerows((r.id, r.vehicle_id, r.lot_id, r.license_plate, r.entry_time.isoformat(), r.exit_time.isoformat() if r.exit_time else "", r.fee if r.fee is not None else "") for r in rows)
+            else:
+                for r in rows: buffer.write(json.dumps(crud.record_to_dict(r), default=str) + "\n")
+            yield buffer.getvalue()
+
+@app.get("/api/records/export")
+async def export_records(format: str = Query("csv", pattern="^(csv|ndjson)$"), start: datetime.datetime | None = None, end: datetime.datetime | None = None):
+    """Streams every record in [start, end) as CSV or NDJSON with constant memory."""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"parking_records.{format}"
+    return StreamingResponse(_export_records(format, start, end), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# --- Reports (read only the hourly rollups) ---
+@app.get("/api/reports/{metric}")
+async def get_report(metric: str, start: datetime.datetime, end: datetime.datetime,
+                     granularity: str = Query("hour", pattern="^(hour|day)$"), lot_id: int | None = None, db = Depends(database.get_session)):
+    """Revenue (fees of exits) or traffic (entries/exits/dwell) per hour or day in [start, end)."""
+    if metric not in ("revenue", "traffic"): raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown report '{metric}'.")
+    buckets = await database.run_sync(db, rollups.report, start, end, granularity=granularity, lot_id=lot_id)
+    if metric == "revenue":
+        buckets = [{"bucket": b["bucket"], "revenue": b["revenue"], "exits": b["exits"]} for b in buckets]
+        return {"granularity": granularity, "total_revenue": round(sum(b["revenue"] for b in buckets), 2), "buckets": buckets}
+    return {"granularity": granularity, "total_entries": sum(b["entries"] for b in buckets), "total_exits": sum(b["exits"] for b in buckets), "buckets": buckets}
+
+# --- Live Occupancy (in-memory; no per-request DB load) ---
+@app.get("/api/occupancy")
+async def get_occupancy(include_sessions: bool = False):
+    """Cars currently inside, optionally with the active sessions."""
+    return occupancy.current(include_sessions=include_sessions)
+
+@app.get("/api/occupancy/stream")
+async def stream_occupancy():
+    """Server-Sent Events: a snapshot on connect, then check-in/check-out deltas."""
+    return StreamingResponse(occupancy.stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Frontend Serving & Health Check (Unchanged) ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request): return templates.TemplateResponse("index.html", {"request": request})
+@app.get("/api/cache/stats")
+async def cache_stats(): return {"qr_cache": qr_cache.stats(), "scan_dedup": scan_dedup.stats()}
 @app.get("/health", status_code=200)
-async def health_check(): return {"status": "OK"}
\ No newline at end of file
+async def health_check():
+    journal = scan_journal.stats() if config.SCAN_JOURNAL_ENABLED else {"enabled": False}
+    return {"status": "OK", "db_pool": database.pool_status(), "startup": startup_timings, "scan_journal": journal}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request/statement/pool-wait latencies and in-process gauges."""
+    pools = database.pool_status()
+    cache = qr_cache.stats()
+    lines = metrics.statement_seconds.render() + metrics.pool_wait_seconds.render() + metrics.request_seconds.render()
+    lines += metrics.gauge("db_pool_checked_out", "Connections currently checked out.", {(("engine", name),): p["checked_out"] for name, p in pools.items()})
+    lines += metrics.gauge("db_pool_saturation", "Checked-out connections / (pool_size + max_overflow).", {(("engine", name),): p["saturation"] for name, p in pools.items()})
+    lines += metrics.gauge("qr_cache_hits_total", "QR resolution cache hits.", {(): cache["hits"]})
+    lines += metrics.gauge("qr_cache_misses_total", "QR resolution cache misses.", {(): cache["misses"]})
+    dedup = scan_dedup.stats()
+    lines += metrics.gauge("scan_dedup_absorbed_total", "Repeated scans answered from memory.", {(): dedup["absorbed"] + dedup["joined_in_flight"]})
+    lines += metrics.gauge("scan_dedup_executed_total", "Scans that reached the handler.", {(): dedup["executed"]})
+    if config.SCAN_JOURNAL_ENABLED:
+        journal = scan_journal.stats()
+        lines += metrics.gauge("scan_journal_pending", "Journaled scans not yet applied to the database.", {(): journal["pending"]})
+        lines += metrics.gauge("scan_journal_lag_seconds", "Age of the oldest journaled scan not yet applied.", {(): journal["lag_seconds"]})
+        lines += metrics.gauge("scan_journal_rejected_total", "Journaled scans the database rejected when applied.", {(): journal["rejected"]})
+        lines += metrics.gauge("scan_journal_flush_failures_total", "Failed flush attempts (retried).", {(): journal["flush_failures"]})
+    lines += metrics.gauge("parking_occupied", "Vehicles currently inside (this worker's view).", {(): occupancy.current()["occupied"]})
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+startup_timings["app_import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
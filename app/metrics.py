@@ -0,0 +1,136 @@
+# app/metrics.py
+"""
+In-process metrics in Prometheus text format (GET /metrics).
+
+- db_statement_seconds: per-statement latency, labelled by operation and table
+  (SQLAlchemy before/after_cursor_execute hooks on both engines).
+- db_pool_wait_seconds: time spent waiting for a pooled connection (instrumented pool classes).
+- http_request_seconds: per-endpoint latency, labelled by route template and status.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (thread-safe)."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names, self.buckets = name, help_text, label_names, buckets
+        self._series: dict[tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets): series[index] += 1
+            series[-2] += value; series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock: snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def gauge(name: str, help_text: str, samples: dict[tuple[tuple[str, str], ...], float]) -> list[str]:
+    """Renders a gauge from {((label, value), ...): sample}."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples.items():
+        label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+statement_seconds = Histogram("db_statement_seconds", "Database statement latency.", ("engine", "operation", "table"))
+pool_wait_seconds = Histogram("db_pool_wait_seconds", "Time waiting to check a connection out of the pool.", ("engine",))
+request_seconds = Histogram("http_request_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+
+# --- SQLAlchemy hooks ---
+_OPERATION = re.compile(r"\b(INSERT|UPDATE|DELETE|SELECT)\b", re.IGNORECASE)
+_TABLE = re.compile(r"\b(?:INTO|UPDATE|FROM)\s+\"?(\w+)", re.IGNORECASE)
+_labels_cache: dict[str, tuple[str, str]] = {}
+
+def statement_labels(statement: str) -> tuple[str, str]:
+    """(operation, table) of a statement; the first DML keyword wins, so CTE-wrapped writes count as writes."""
+    labels = _labels_cache.get(statement)
+    if labels is None:
+        operations = [m.group(1).upper() for m in _OPERATION.finditer(statement)]
+        operation = next((op for op in ("INSERT", "UPDATE", "DELETE") if op in operations), operations[0] if operations else "OTHER")
+        table = _TABLE.search(statement)
+        labels = (operation, table.group(1) if table else "none")
+        if len(_labels_cache) < 2000: _labels_cache[statement] = labels # Statements come from a small, fixed set
+    return labels
+
+def instrument_engine(sync_engine, name: str) -> None:
+    """Records per-statement latency for an Engine (for an AsyncEngine pass .sync_engine)."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        statement_seconds.observe(time.perf_counter() - started, name, *statement_labels(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts: starts.pop()
+
+class _PoolWaitMixin:
+    metrics_name = "sync"
+    def _do_get(self):
+        started = time.perf_counter()
+        try: return super()._do_get()
+        finally: pool_wait_seconds.observe(time.perf_counter() - started, self.metrics_name)
+
+class InstrumentedQueuePool(_PoolWaitMixin, QueuePool):
+    """QueuePool that records checkout wait time."""
+    metrics_name = "sync"
+
+class InstrumentedAsyncPool(_PoolWaitMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records checkout wait time."""
+    metrics_name = "async"
+
+def pool_status(pool, max_overflow: int) -> dict:
+    """Checked-out connections vs capacity (pool_size + max_overflow)."""
+    capacity = pool.size() + max_overflow
+    checked_out = pool.checkedout()
+    return {"size": pool.size(), "checked_out": checked_out, "overflow": max(pool.overflow(), 0), "capacity": capacity,
+            "saturation": round(checked_out / capacity, 3) if capacity else None}
+
+# --- Per-endpoint latency (pure ASGI, so streaming responses are not buffered) ---
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        started, status = time.perf_counter(), [500]
+        async def send_with_status(message):
+            if message["type"] == "http.response.start": status[0] = message["status"]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            request_seconds.observe(time.perf_counter() - started, scope["method"], getattr(route, "path", None) or "unmatched", status[0])
@@ -1,10 +1,11 @@
 # app/models.py
 
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric
+    Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Numeric, Index, Sequence, text
 )
 from sqlalchemy.orm import relationship
 import datetime
+import re
 import pytz
 
 from app.database import Base
@@ -20,29 +21,61 @@ class Owner(Base):
     def __repr__(self):
         return f"<Owner(name='{self.name}', phone='{self.phone_number}')>"
 
+_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+
+def normalize_plate(license_plate: str) -> str:
+    """Uppercase, alphanumeric only: 'mh 12-ab 1234' -> 'MH12AB1234'. Matches the SQL backfill in table_creation.txt."""
+    return _NON_ALNUM.sub("", (license_plate or "").upper())
+
+def _plate_normalized_default(context) -> str:
+    return normalize_plate(context.get_current_parameters()["license_plate"])
+
 class Vehicle(Base):
     """Represents a vehicle registered in the system, linked to an owner."""
     __tablename__ = "vehicles"
     id = Column(Integer, primary_key=True, index=True)
     license_plate = Column(String(20), unique=True, nullable=False, index=True)
+    # Indexed lookup key for every plate search/duplicate check; filled from license_plate on insert
+    plate_normalized = Column(String(20), unique=True, nullable=False, default=_plate_normalized_default)
     qr_code = Column(String, unique=True, nullable=False, index=True)
     owner_id = Column(Integer, ForeignKey("owners.id", ondelete="SET NULL"), nullable=True)
     owner = relationship("Owner", back_populates="vehicles")
     # Relationship to parking records (history)
     parking_records = relationship("ParkingRecord", back_populates="vehicle", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Trigram index for partial/fuzzy plate search (requires the pg_trgm extension)
+        Index("idx_vehicles_plate_trgm", "plate_normalized", postgresql_using="gin", postgresql_ops={"plate_normalized": "gin_trgm_ops"}),
+    )
+
     def __repr__(self):
         owner_info = f", owner_id={self.owner_id}" if self.owner_id else ""
         return f"<Vehicle(license_plate='{self.license_plate}'{owner_info})>"
 
 # --- ParkingSpot model is REMOVED ---
 
+DEFAULT_LOT_ID = 0 # The unnamed lot used when a request does not name one
+
+class Lot(Base):
+    """A parking lot. occupied is a counter kept by check-in/check-out, not a count of records."""
+    __tablename__ = "lots"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False)
+    capacity = Column(Integer, nullable=True) # NULL = unlimited
+    occupied = Column(Integer, nullable=False, default=0, server_default=text("0"))
+
+    def __repr__(self):
+        return f"<Lot(id={self.id}, name='{self.name}', occupied={self.occupied}/{self.capacity})>"
+
 class ParkingRecord(Base):
     """Represents a check-in/out time interval for a vehicle."""
     __tablename__ = "parking_records"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # The table is partitioned by exit_time, and Postgres only allows primary keys that
+    # include the partition key, so id is the ORM identity but not a database PK.
+    id = Column(Integer, Sequence("parking_records_id_seq"), server_default=text("nextval('parking_records_id_seq')"), nullable=False, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
+    lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False, default=DEFAULT_LOT_ID, server_default=text(str(DEFAULT_LOT_ID)))
     # --- spot_id and spot relationship REMOVED ---
     entry_time = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.datetime.now(pytz.utc))
     exit_time = Column(DateTime(timezone=True), nullable=True) # Null indicates currently checked-in
@@ -51,6 +84,40 @@ class ParkingRecord(Base):
     vehicle = relationship("Vehicle", back_populates="parking_records")
     # --- spot relationship REMOVED ---
 
+    __table_args__ = (
+        # Keyset pagination: per-vehicle history and the global record listing
+        Index("idx_parking_records_vehicle_entry", "vehicle_id", "entry_time"),
+        Index("idx_parking_records_entry_time", "entry_time", "id"),
+        # Monthly partitions by exit_time; open records (NULL) go to the default partition, which
+        # carries the one-open-record-per-vehicle unique index. See app/partitions.py.
+        {"postgresql_partition_by": "RANGE (exit_time)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self):
         status = "Active" if self.exit_time is None else f"Completed ({self.exit_time})"
-        return f"<ParkingRecord(id={self.id}, vehicle_id={self.vehicle_id}, entry={self.entry_time}, status='{status}')>"
\ No newline at end of file
+        return f"<ParkingRecord(id={self.id}, vehicle_id={self.vehicle_id}, entry={self.entry_time}, status='{status}')>"
+
+class ParkingRollup(Base):
+    """Per-lot, per-hour traffic and revenue totals, maintained alongside check-in/out."""
+    __tablename__ = "parking_rollups"
+
+    lot_id = Column(Integer, primary_key=True, default=DEFAULT_LOT_ID)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True) # Hour bucket, UTC
+    entries = Column(Integer, nullable=False, default=0)
+    exits = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(12, 2), nullable=False, default=0) # Fees of exits in this hour
+    dwell_seconds = Column(BigInteger, nullable=False, default=0) # Total stay length of exits in this hour
+
+    def __repr__(self):
+        return f"<ParkingRollup(lot_id={self.lot_id}, bucket={self.bucket_start}, entries={self.entries}, exits={self.exits})>"
+
+class ScanJournalOffset(Base):
+    """Last journal sequence number applied, per journal file; written in the same transaction as the scans."""
+    __tablename__ = "scan_journal_offsets"
+
+    journal_id = Column(String(100), primary_key=True) # Journal file name
+    seq = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<ScanJournalOffset(journal_id='{self.journal_id}', seq={self.seq})>"
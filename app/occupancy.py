@@ -0,0 +1,103 @@
+# app/occupancy.py
+
+import asyncio
+import datetime
+import json
+import threading
+
+import pytz
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import config, models
+
+class OccupancyTracker:
+    """
+    Incrementally maintained "cars currently inside" figure and active-session list.
+
+    Seeded from the database once (exit_time IS NULL prunes the query to the small
+    parking_records_open partition, read via uq_parking_records_one_active), then updated
+    in memory after each committed check-in/check-out and pushed to SSE subscribers,
+    so dashboards never query the database themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: dict[int, dict] = {} # vehicle_id -> active session
+        self._subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+        self.updated_at: datetime.datetime | None = None
+
+    # --- State ---
+    def load_snapshot(self, db: Session) -> int:
+        """Replaces the in-memory state with the open records in the database."""
+        return self.replace(self.read_sessions(db))
+
+    def read_sessions(self, db: Session) -> dict[int, dict]:
+        rows = db.execute(select(models.ParkingRecord.id, models.ParkingRecord.vehicle_id, models.ParkingRecord.lot_id, models.ParkingRecord.entry_time, models.Vehicle.license_plate)
+                          .join(models.Vehicle, models.ParkingRecord.vehicle_id == models.Vehicle.id)
+                          .where(models.ParkingRecord.exit_time.is_(None))).all()
+        return {r.vehicle_id: {"record_id": r.id, "vehicle_id": r.vehicle_id, "lot_id": r.lot_id, "license_plate": r.license_plate, "entry_time": r.entry_time} for r in rows}
+
+    def replace(self, sessions: dict[int, dict]) -> int:
+        with self._lock:
+            changed = sessions.keys() != self._sessions.keys()
+            self._sessions = sessions; self.updated_at = datetime.datetime.now(pytz.utc)
+        if changed: self._publish("resync", {"occupied": len(sessions)})
+        return len(sessions)
+
+    def checked_in(self, record: dict) -> None:
+        session = {key: record.get(key) for key in ("record_id", "vehicle_id", "lot_id", "license_plate", "entry_time")}
+        with self._lock:
+            self._sessions[session["vehicle_id"]] = session; self.updated_at = datetime.datetime.now(pytz.utc)
+            occupied = len(self._sessions)
+        self._publish("checkin", {**session, "occupied": occupied})
+
+    def checked_out(self, details: dict) -> None:
+        with self._lock:
+            self._sessions.pop(details.get("vehicle_id"), None); self.updated_at = datetime.datetime.now(pytz.utc)
+            occupied = len(self._sessions)
+        self._publish("checkout", {key: details.get(key) for key in ("record_id", "vehicle_id", "lot_id", "license_plate", "exit_time", "fee")} | {"occupied": occupied})
+
+    def session_of(self, vehicle_id: int) -> dict | None:
+        with self._lock: return self._sessions.get(vehicle_id)
+
+    def current(self, include_sessions: bool = False) -> dict:
+        with self._lock:
+            by_lot = {}
+            for session in self._sessions.values(): by_lot[session["lot_id"]] = by_lot.get(session["lot_id"], 0) + 1
+            result = {"occupied": len(self._sessions), "lots": by_lot, "updated_at": self.updated_at}
+            if include_sessions: result["sessions"] = sorted(self._sessions.values(), key=lambda s: s["entry_time"])
+        return result
+
+    # --- Server-Sent Events ---
+    def _publish(self, event: str, data: dict) -> None:
+        message = _sse(event, data)
+        with self._lock: subscribers = list(self._subscribers) # stream() adds/discards on the event loop
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(_offer, queue, message) # Publishers may run in worker threads
+
+    async def stream(self):
+        """Async iterator of SSE messages: a snapshot, then check-in/check-out deltas and heartbeats."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=1000))
+        with self._lock: self._subscribers.add(subscriber)
+        try:
+            yield _sse("snapshot", self.current(include_sessions=True))
+            while True:
+                try: yield await asyncio.wait_for(subscriber[1].get(), timeout=config.OCCUPANCY_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError: yield ": heartbeat\n\n"
+        finally:
+            with self._lock: self._subscribers.discard(subscriber)
+
+def _offer(queue: asyncio.Queue, message: str) -> None:
+    try: queue.put_nowait(message)
+    except asyncio.QueueFull: pass # Slow dashboard; the next resync/snapshot brings it back in line
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default)}\n\n"
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)): return value.isoformat()
+    return str(value)
+
+# Process-wide instance
+tracker = OccupancyTracker()
@@ -0,0 +1,300 @@
+# app/partitions.py
+"""
+Monthly partitions of parking_records and the cold archive.
+
+parking_records is range-partitioned by exit_time:
+    parking_records_open      DEFAULT partition: open records (exit_time IS NULL). Carries the
+                              one-open-record-per-vehicle unique index check-in relies on.
+    parking_records_YYYY_MM   closed records, by UTC exit month.
+Checking out moves the row from the default partition into its month.
+
+Archiving writes each closed month older than RECORD_ARCHIVE_AFTER_MONTHS to
+RECORD_ARCHIVE_DIR/parking_records_YYYY_MM.ndjson.gz (sorted by entry_time, id)
+plus a vehicle index next to it (the month's distinct vehicle_ids, sorted int32),
+records both in manifest.json and drops the partition. Per-vehicle history only
+opens the month files whose index contains the vehicle. Everything that exited
+before the archive horizon (end of the newest archived month) is read from the
+files, everything else from the database, so history and export see one table
+(crud.list_parking_records / iter_parking_records). Reports read parking_rollups,
+which archiving never touches.
+
+Usage:
+    python -m app.partitions ensure               # create this month + RECORD_PARTITIONS_AHEAD (run monthly)
+    python -m app.partitions migrate              # convert an unpartitioned parking_records table in place
+    python -m app.partitions archive [--months N] [--dry-run]
+    python -m app.partitions index                # build vehicle indexes for months archived without one
+"""
+
+import datetime
+import gzip
+import sys
+from array import array
+from bisect import bisect_left
+import heapq
+import itertools
+import json
+import os
+import re
+from decimal import Decimal
+from typing import NamedTuple
+
+import pytz
+from sqlalchemy import text
+
+from app import config, models
+
+DEFAULT_PARTITION = "parking_records_open"
+MANIFEST_FILE = "manifest.json"
+_MONTH_PARTITION = re.compile(r"^parking_records_(\d{4})_(\d{2})$")
+
+# Indexes the old, unpartitioned table may own; their names would clash with the new table's (see migrate)
+_LEGACY_INDEXES = ("uq_parking_records_one_active", "idx_parking_records_vehicle_entry", "idx_parking_records_entry_time",
+                   "idx_parking_records_vehicle_id", "idx_parking_records_active", "ix_parking_records_id")
+
+class ArchivedRecord(NamedTuple):
+    """A parking record read back from an archive file; same fields as crud._record_columns."""
+    id: int
+    vehicle_id: int
+    lot_id: int
+    license_plate: str
+    entry_time: datetime.datetime
+    exit_time: datetime.datetime
+    fee: Decimal | None
+
+# --- Months ---
+def _utc(moment: datetime.datetime) -> datetime.datetime:
+    return moment.astimezone(pytz.utc) if moment.tzinfo else pytz.utc.localize(moment)
+
+def month_start(moment: datetime.datetime) -> datetime.datetime:
+    return _utc(moment).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month: datetime.datetime, count: int) -> datetime.datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"parking_records_{month:%Y_%m}"
+
+# --- Live partitions ---
+def live_partitions(conn) -> dict[str, datetime.datetime]:
+    """Monthly partitions currently attached to parking_records, name -> month start."""
+    names = conn.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                              "WHERE i.inhparent = 'parking_records'::regclass")).scalars()
+    months = {}
+    for name in names:
+        match = _MONTH_PARTITION.match(name)
+        if match: months[name] = datetime.datetime(int(match[1]), int(match[2]), 1, tzinfo=pytz.utc)
+    return months
+
+def ensure_partitions(conn, first_month: datetime.datetime | None = None, months_ahead: int | None = None) -> list[str]:
+    """
+    Creates the default partition (with its unique index) and every month from
+    first_month (default: this month) to RECORD_PARTITIONS_AHEAD months ahead.
+    Returns the names of the partitions that were missing.
+
+    A month must exist before its first check-out: otherwise those rows land in the
+    default partition and Postgres refuses to create the month until they are moved.
+    """
+    created = []
+    existing = set(live_partitions(conn))
+    if not conn.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar():
+        conn.exec_driver_sql(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF parking_records DEFAULT")
+        created.append(DEFAULT_PARTITION)
+    conn.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_parking_records_one_active "
+                         f"ON {DEFAULT_PARTITION} (vehicle_id) WHERE exit_time IS NULL")
+    month = month_start(first_month or datetime.datetime.now(pytz.utc))
+    last = add_months(month_start(datetime.datetime.now(pytz.utc)), config.RECORD_PARTITIONS_AHEAD if months_ahead is None else months_ahead)
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            conn.exec_driver_sql(f"CREATE TABLE {name} PARTITION OF parking_records "
+                                 f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')")
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+def migrate(conn) -> int:
+    """
+    Converts a pre-partitioning parking_records table (table_creation.txt before
+    partitioning) in one transaction: rename, create the partitioned table, copy,
+    drop. Keeps ids and the id sequence; every record goes to the default lot, so
+    the lots table must exist (python -m app.database). Returns the number of records copied.
+    """
+    conn.exec_driver_sql("ALTER SEQUENCE parking_records_id_seq OWNED BY NONE") # Survives dropping the old table
+    conn.exec_driver_sql("ALTER TABLE parking_records RENAME TO parking_records_unpartitioned")
+    for index in _LEGACY_INDEXES: conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+    models.Base.metadata.create_all(bind=conn, tables=[models.ParkingRecord.__table__])
+    first_exit = conn.exec_driver_sql("SELECT min(exit_time) FROM parking_records_unpartitioned").scalar()
+    ensure_partitions(conn, first_month=first_exit)
+    copied = conn.exec_driver_sql("INSERT INTO parking_records (id, vehicle_id, entry_time, exit_time, fee) "
+                                  "SELECT id, vehicle_id, entry_time, exit_time, fee FROM parking_records_unpartitioned").rowcount
+    from app import crud
+    crud.recount_lot_occupancy(conn) # Copied open records count against the default lot
+    conn.exec_driver_sql("ALTER SEQUENCE parking_records_id_seq OWNED BY parking_records.id")
+    conn.exec_driver_sql("DROP TABLE parking_records_unpartitioned")
+    return copied
+
+# --- Archive files ---
+_manifest_cache: tuple[float, dict] | None = None
+
+def load_manifest() -> dict:
+    """{"YYYY-MM": {"file", "vehicles", "rows", "min_entry", "max_entry"}} for every archived month (re-read when the file changes)."""
+    global _manifest_cache
+    path = os.path.join(config.RECORD_ARCHIVE_DIR, MANIFEST_FILE)
+    try: mtime = os.path.getmtime(path)
+    except OSError: return {}
+    if _manifest_cache is None or _manifest_cache[0] != mtime:
+        with open(path, encoding="utf-8") as f: _manifest_cache = (mtime, json.load(f))
+    return _manifest_cache[1]
+
+def _save_manifest(manifest: dict) -> None:
+    path = os.path.join(config.RECORD_ARCHIVE_DIR, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=1); f.flush(); os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def archive_horizon() -> datetime.datetime | None:
+    """Records that exited before this instant are in the archive files, not in the database. None if nothing is archived."""
+    manifest = load_manifest()
+    if not manifest: return None
+    year, month = map(int, max(manifest).split("-"))
+    return add_months(datetime.datetime(year, month, 1, tzinfo=pytz.utc), 1)
+
+def _read_file(path: str):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            yield ArchivedRecord(row["id"], row["vehicle_id"], row.get("lot_id", models.DEFAULT_LOT_ID), row["license_plate"], datetime.datetime.fromisoformat(row["entry_time"]),
+                                 datetime.datetime.fromisoformat(row["exit_time"]), Decimal(row["fee"]) if row["fee"] is not None else None)
+
+# --- Vehicle indexes ---
+_vehicle_index_cache: dict[str, tuple[float, array]] = {} # index file -> (mtime, sorted vehicle ids)
+
+def _write_vehicle_index(path: str, vehicle_ids) -> None:
+    ids = array("i", sorted(vehicle_ids))
+    if sys.byteorder == "big": ids.byteswap() # Stored little-endian
+    with open(path + ".tmp", "wb") as f: ids.tofile(f); f.flush(); os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def _may_contain(entry: dict, vehicle_id: int) -> bool:
+    """False when the month's vehicle index has no record of vehicle_id. Months without an index are always read."""
+    if not entry.get("vehicles"): return True
+    path = os.path.join(config.RECORD_ARCHIVE_DIR, entry["vehicles"])
+    try: mtime = os.path.getmtime(path)
+    except OSError: return True
+    cached = _vehicle_index_cache.get(entry["vehicles"])
+    if cached is None or cached[0] != mtime:
+        ids = array("i")
+        with open(path, "rb") as f: ids.frombytes(f.read())
+        if sys.byteorder == "big": ids.byteswap()
+        _vehicle_index_cache[entry["vehicles"]] = cached = (mtime, ids)
+    ids = cached[1]; i = bisect_left(ids, vehicle_id)
+    return i < len(ids) and ids[i] == vehicle_id
+
+def index_archives() -> list[str]:
+    """Builds the vehicle index of every archived month that has none (archived before indexes existed)."""
+    manifest, indexed = dict(load_manifest()), []
+    for month, entry in sorted(manifest.items()):
+        if entry.get("vehicles"): continue
+        name = entry["file"].removesuffix(".ndjson.gz") + ".vehicles.bin"
+        _write_vehicle_index(os.path.join(config.RECORD_ARCHIVE_DIR, name),
+                             {row.vehicle_id for row in _read_file(os.path.join(config.RECORD_ARCHIVE_DIR, entry["file"]))})
+        manifest[month] = {**entry, "vehicles": name}; _save_manifest(manifest); indexed.append(month)
+    return indexed
+
+def _matching(vehicle_id: int | None, start: datetime.datetime | None, end: datetime.datetime | None,
+              below: tuple | None = None, above: tuple | None = None):
+    """
+    (max_entry, rows) per archived month, oldest first: rows lazily reads the file (sorted by
+    entry_time, id) and keeps those passing the filters. Months outside the range, or whose
+    vehicle index lacks vehicle_id, are skipped without opening their file.
+    """
+    start, end = start and _utc(start), end and _utc(end)
+    below = below and (_utc(below[0]), below[1]); above = above and (_utc(above[0]), above[1])
+    for month, entry in sorted(load_manifest().items()):
+        min_entry, max_entry = datetime.datetime.fromisoformat(entry["min_entry"]), datetime.datetime.fromisoformat(entry["max_entry"])
+        if (start and max_entry < start) or (end and min_entry >= end) or (below and min_entry > below[0]) or (above and max_entry < above[0]):
+            continue
+        if vehicle_id is not None and not _may_contain(entry, vehicle_id): continue
+        yield max_entry, (row for row in _read_file(os.path.join(config.RECORD_ARCHIVE_DIR, entry["file"]))
+               if (vehicle_id is None or row.vehicle_id == vehicle_id) and (not start or row.entry_time >= start)
+               and (not end or row.entry_time < end) and (not below or (row.entry_time, row.id) < below)
+               and (not above or (row.entry_time, row.id) > above))
+
+def iter_archived(vehicle_id: int | None = None, start: datetime.datetime | None = None, end: datetime.datetime | None = None):
+    """Archived records with entry_time in [start, end), oldest first (lazy merge of the month files)."""
+    return heapq.merge(*(rows for _, rows in _matching(vehicle_id, start, end)), key=lambda row: (row.entry_time, row.id))
+
+def archived_page(limit: int, vehicle_id: int | None = None, start: datetime.datetime | None = None, end: datetime.datetime | None = None,
+                  below: tuple | None = None, above: tuple | None = None) -> list[ArchivedRecord]:
+    """
+    The newest `limit` archived records strictly between the (entry_time, id) keys above and below.
+    Months are read newest first, and reading stops once no older month can hold a newer record.
+    """
+    key = lambda row: (row.entry_time, row.id)
+    page = []
+    for max_entry, rows in sorted(_matching(vehicle_id, start, end, below, above), key=lambda month: month[0], reverse=True):
+        if page and len(page) >= limit and max_entry < page[-1].entry_time: break
+        page = heapq.nlargest(limit, itertools.chain(page, rows), key=key)
+    return page
+
+def _write_month(conn, name: str, path: str) -> dict:
+    """Streams one partition (joined with the plate) into a gzipped NDJSON file and its vehicle index; returns its manifest entry."""
+    rows, min_entry, max_entry, vehicle_ids = 0, None, None, set()
+    result = conn.execute(text(f"SELECT pr.id, pr.vehicle_id, pr.lot_id, v.license_plate, pr.entry_time, pr.exit_time, pr.fee "
+                               f"FROM {name} pr JOIN vehicles v ON v.id = pr.vehicle_id ORDER BY pr.entry_time, pr.id")
+                          .execution_options(yield_per=5000))
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for row in result:
+            f.write(json.dumps({"id": row.id, "vehicle_id": row.vehicle_id, "lot_id": row.lot_id, "license_plate": row.license_plate,
+                                "entry_time": row.entry_time.isoformat(), "exit_time": row.exit_time.isoformat(),
+                                "fee": str(row.fee) if row.fee is not None else None}) + "\n")
+            rows += 1; min_entry = min_entry or row.entry_time; max_entry = row.entry_time; vehicle_ids.add(row.vehicle_id)
+    with open(path + ".tmp", "rb") as f: os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    index_path = path.removesuffix(".ndjson.gz") + ".vehicles.bin"
+    _write_vehicle_index(index_path, vehicle_ids)
+    return {"file": os.path.basename(path), "vehicles": os.path.basename(index_path), "rows": rows,
+            "min_entry": (min_entry or datetime.datetime.min.replace(tzinfo=pytz.utc)).isoformat(),
+            "max_entry": (max_entry or datetime.datetime.min.replace(tzinfo=pytz.utc)).isoformat()}
+
+def archive(engine, months: int | None = None, dry_run: bool = False) -> list[str]:
+    """
+    Archives every month partition that ended more than `months` months ago, oldest
+    first. Order per month: file (fsynced), manifest, then DROP TABLE, so a crash
+    never loses rows; a month left both archived and live is only read from the
+    archive (the live side is cut at archive_horizon) and is dropped on the next run.
+    """
+    cutoff = add_months(month_start(datetime.datetime.now(pytz.utc)), -(months or config.RECORD_ARCHIVE_AFTER_MONTHS))
+    os.makedirs(config.RECORD_ARCHIVE_DIR, exist_ok=True)
+    with engine.connect() as conn: candidates = sorted((month, name) for name, month in live_partitions(conn).items())
+    manifest, archived = dict(load_manifest()), []
+    for month, name in candidates:
+        if add_months(month, 1) > cutoff: break
+        archived.append(name)
+        if dry_run: continue
+        key = f"{month:%Y-%m}"
+        if key not in manifest:
+            with engine.connect() as conn: manifest[key] = _write_month(conn, name, os.path.join(config.RECORD_ARCHIVE_DIR, f"{name}.ndjson.gz"))
+            _save_manifest(manifest)
+        with engine.begin() as conn: conn.exec_driver_sql(f"DROP TABLE {name}")
+        print(f"Archived {name}: {manifest[key]['rows']} records.")
+    return archived
+
+if __name__ == "__main__":
+    import argparse
+    from app import database
+    parser = argparse.ArgumentParser(description="Manage parking_records partitions and archives.")
+    parser.add_argument("command", choices=("ensure", "migrate", "archive", "index"))
+    parser.add_argument("--months", type=int, help=f"archive: keep this many months live (default {config.RECORD_ARCHIVE_AFTER_MONTHS})")
+    parser.add_argument("--dry-run", action="store_true", help="archive: only list the partitions that would be archived")
+    args = parser.parse_args()
+    if args.command == "ensure":
+        with database.engine.begin() as conn: print(f"Created partitions: {ensure_partitions(conn) or 'none'}")
+    elif args.command == "migrate":
+        with database.engine.begin() as conn: print(f"Migrated {migrate(conn)} records into partitioned parking_records.")
+    elif args.command == "index":
+        print(f"Indexed archived months: {index_archives() or 'none'}")
+    else:
+        names = archive(database.engine, args.months, args.dry_run)
+        print(f"{'Would archive' if args.dry_run else 'Archived'}: {names or 'nothing'}")
@@ -1,18 +1,96 @@
 # app/qr_code.py
 
-import qrcode
 import uuid
 import os
+import io
+import re
+import hmac
+import base64
+import hashlib
+from functools import lru_cache
+from urllib.parse import quote
 
 # Import config to get the directory path
 from app import config
 
-def generate_qr_code(license_plate: str) -> tuple[str, str]:
+# --- Signed Payloads ---
+# V1.<vehicle id>.<base32 of the first 15 bytes of HMAC-SHA256(QR_SIGNING_KEY, "V1.<vehicle id>")>.
+# Uppercase, digits and dots only, so the code is encoded in QR alphanumeric mode.
+_SIGNED_QR = re.compile(r"V1\.([1-9][0-9]{0,9})\.([A-Z2-7]{24})")
+_LEGACY_QR = re.compile(r"[^\W_]*-[0-9a-f]{8}") # PLATE-<8 hex>, issued before signed codes (plate: str.isalnum characters)
+
+def _signature(vehicle_id: int) -> str:
+    digest = hmac.new(config.QR_SIGNING_KEY.encode(), f"V1.{vehicle_id}".encode(), hashlib.sha256).digest()
+    return base64.b32encode(digest[:15]).decode()
+
+def signed_qr_data(vehicle_id: int) -> str:
+    """Builds the signed QR payload of a vehicle (needs QR_SIGNING_KEY)."""
+    return f"V1.{vehicle_id}.{_signature(vehicle_id)}"
+
+def parse_qr_data(qr_data: str) -> tuple[str, int | None] | None:
+    """
+    Classifies a scanned payload without touching the database: ("signed", vehicle_id)
+    when the signature verifies, ("legacy", None) for a PLATE-<8 hex> code (if
+    QR_ACCEPT_LEGACY), None for anything else (garbage, foreign or forged codes).
+    """
+    match = _SIGNED_QR.fullmatch(qr_data)
+    if match:
+        if not config.QR_SIGNING_KEY or not hmac.compare_digest(match.group(2), _signature(int(match.group(1)))): return None
+        return "signed", int(match.group(1))
+    if config.QR_ACCEPT_LEGACY and _LEGACY_QR.fullmatch(qr_data): return "legacy", None
+    return None
+
+def new_qr_data(license_plate: str, vehicle_id: int | None = None) -> str:
+    """
+    Builds the string embedded in a vehicle's QR code: signed_qr_data(vehicle_id) when
+    QR_SIGNING_KEY is set and the id is known, else the legacy PLATE-<8 hex>.
+    """
+    if vehicle_id is not None and config.QR_SIGNING_KEY: return signed_qr_data(vehicle_id)
+    # Create a unique identifier combined with the license plate for the QR data
+    # Using a simpler unique part here, ensure it meets uniqueness needs
+    unique_id = str(uuid.uuid4())[:8]
+    # Make QR data simple, could just be the unique ID or a combo
+    # Let's use the combo for potential lookup later, ensure filename safety
+    safe_plate = "".join(filter(str.isalnum, license_plate)).upper()
+    return f"{safe_plate}-{unique_id}" # Data stored in QR
+
+def qr_file_path_for(qr_data: str) -> str:
+    """Relative path of the PNG for qr_data (qr_data is filename-safe by construction)."""
+    return os.path.join(config.QR_CODE_DIR, f"{qr_data}.png")
+
+def render_qr_png(qr_data: str, qr_file_path: str) -> str:
+    """Renders qr_data to a PNG at qr_file_path. Top-level so it can run in a process pool."""
+    import qrcode # Deferred: qrcode/PIL are slow to import and only needed when rendering
+    os.makedirs(os.path.dirname(qr_file_path) or ".", exist_ok=True)
+    qrcode.make(qr_data).save(qr_file_path)
+    return qr_file_path
+
+def qr_image_url(qr_data: str, fmt: str = "png") -> str:
+    """URL of the on-demand rendered image for qr_data."""
+    return f"{config.QR_IMAGE_URL_PATH}/{quote(qr_data, safe='')}.{fmt}"
+
+QR_IMAGE_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+@lru_cache(maxsize=config.QR_IMAGE_CACHE_SIZE)
+def render_qr(qr_data: str, fmt: str = "png") -> bytes:
+    """Encodes qr_data as PNG or SVG bytes. LRU-cached: a code's image never changes."""
+    if fmt not in QR_IMAGE_MEDIA_TYPES: raise ValueError(f"Unsupported QR image format '{fmt}'.")
+    import qrcode # Deferred, see render_qr_png
+    buffer = io.BytesIO()
+    if fmt == "svg":
+        from qrcode.image.svg import SvgPathImage
+        qrcode.make(qr_data, image_factory=SvgPathImage).save(buffer)
+    else:
+        qrcode.make(qr_data).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def generate_qr_code(license_plate: str, vehicle_id: int | None = None) -> tuple[str, str]:
     """
     Generates QR code data and saves it as a PNG image.
 
     Args:
         license_plate: The license plate number.
+        vehicle_id: The (preallocated) vehicle id, for a signed payload.
 
     Returns:
         A tuple containing:
@@ -23,26 +101,12 @@ def generate_qr_code(license_plate: str) -> tuple[str, str]:
     if not license_plate:
         return None, None
 
-    # Create a unique identifier combined with the license plate for the QR data
-    # Using a simpler unique part here, ensure it meets uniqueness needs
-    unique_id = str(uuid.uuid4())[:8]
-    # Make QR data simple, could just be the unique ID or a combo
-    # Let's use the combo for potential lookup later, ensure filename safety
-    safe_plate = "".join(filter(str.isalnum, license_plate)).upper()
-    qr_data = f"{safe_plate}-{unique_id}" # Data stored in QR
-
-    # Ensure the target directory exists
-    save_dir = config.QR_CODE_DIR
-    os.makedirs(save_dir, exist_ok=True)
-
-    # Generate file path - use qr_data as filename (ensure it's filename-safe)
-    qr_file_name = f"{qr_data}.png"
-    qr_file_path = os.path.join(save_dir, qr_file_name)
+    qr_data = new_qr_data(license_plate, vehicle_id)
+    qr_file_path = qr_file_path_for(qr_data)
 
     try:
         # Create and save the QR code image
-        qr_img = qrcode.make(qr_data)
-        qr_img.save(qr_file_path)
+        render_qr_png(qr_data, qr_file_path)
 
         print(f"Generated QR Code for {license_plate}: data='{qr_data}', path='{qr_file_path}'")
         # Return the data and the relative path for storage/reference
@@ -50,4 +114,4 @@ def generate_qr_code(license_plate: str) -> tuple[str, str]:
 
     except Exception as e:
         print(f"Error generating QR code for {license_plate}: {e}")
-        return None, None
\ No newline at end of file
+        return None, None
@@ -0,0 +1,55 @@
+# app/responses.py
+"""
+JSON encoding for API responses.
+
+Uses orjson when it is installed (optional dependency), stdlib json otherwise.
+FastJSONResponse is the app's default response class. The scan endpoints go
+further: they encode their payload once with status_body() and return json_response(),
+and FastAPI skips response_model validation and serialization for Response
+return values (response_model then only documents the schema).
+"""
+
+import datetime
+import json
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse, Response
+
+from app import schemas
+
+try:
+    import orjson
+except ImportError: # Optional: falls back to the stdlib encoder
+    orjson = None
+
+def _default(value):
+    if isinstance(value, datetime.datetime) and value.utcoffset() == datetime.timedelta(0): return value.isoformat().replace("+00:00", "Z")
+    if isinstance(value, (datetime.datetime, datetime.date)): return value.isoformat()
+    if isinstance(value, Decimal): return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS # "Z" for UTC, as pydantic writes it
+    def dumps(content) -> bytes:
+        """Encodes content (dicts, lists, datetimes, Decimals) as compact UTF-8 JSON."""
+        return orjson.dumps(content, default=_default, option=_OPTIONS)
+else:
+    def dumps(content) -> bytes:
+        """Encodes content (dicts, lists, datetimes, Decimals) as compact UTF-8 JSON."""
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()."""
+    def render(self, content) -> bytes: return dumps(content)
+
+def json_response(body: bytes, status_code: int = 200, headers: dict | None = None) -> Response:
+    """Wraps an already encoded JSON body."""
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+# --- VehicleStatusResponse bodies ---
+# The scan endpoints encode their body once (and the dedup window replays the bytes);
+# response_model only documents it. Every schema field is always present, as before.
+STATUS_FIELDS = tuple(schemas.VehicleStatusResponse.model_fields)
+
+def status_body(**fields) -> bytes:
+    return dumps({name: fields.get(name) for name in STATUS_FIELDS})
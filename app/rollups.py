@@ -0,0 +1,121 @@
+# app/rollups.py
+"""
+Hourly traffic/revenue rollups (parking_rollups).
+
+Check-in adds an entry to the hour of entry_time; check-out adds an exit, its
+fee and its stay length to the hour of exit_time. The upserts are attached as
+data-modifying CTEs to the statements that already create/price the record,
+so they commit atomically with it and cost no extra round trip. Reports read
+only the rollups: O(buckets), not O(records).
+
+Usage (rebuild from history):
+    python -m app.rollups --rebuild [--start 2026-01-01] [--end 2026-02-01]
+"""
+
+import datetime
+from decimal import Decimal
+
+import pytz
+from sqlalchemy import select, literal, delete, text, func, cast, DateTime, Integer, Numeric, BigInteger
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app import config, models
+
+DEFAULT_LOT_ID = models.DEFAULT_LOT_ID
+GRANULARITIES = ("hour", "day")
+_rollup = models.ParkingRollup.__table__
+
+def bucket_start(moment: datetime.datetime) -> datetime.datetime:
+    """Start of the UTC hour containing moment."""
+    moment = moment.astimezone(pytz.utc) if moment.tzinfo else pytz.utc.localize(moment)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def _value(value, type_):
+    return value if isinstance(value, ColumnElement) else literal(value, type_)
+
+def _upsert_from(source, lot_id, bucket: datetime.datetime, entries: int = 0, exits: int = 0,
+                 revenue=Decimal("0"), dwell_seconds=0):
+    """
+    INSERT ... SELECT <one rollup delta per row of source> ON CONFLICT DO UPDATE (adds the delta).
+    lot_id, revenue and dwell_seconds may be values or column expressions over source.
+    """
+    insert = pg_insert(_rollup).from_select(
+        ["lot_id", "bucket_start", "entries", "exits", "revenue", "dwell_seconds"],
+        select(_value(lot_id, Integer), literal(bucket, DateTime(timezone=True)), literal(entries, Integer),
+               literal(exits, Integer), _value(revenue, Numeric(12, 2)), _value(dwell_seconds, BigInteger)).select_from(source))
+    return insert.on_conflict_do_update(
+        index_elements=[_rollup.c.lot_id, _rollup.c.bucket_start],
+        set_={name: _rollup.c[name] + insert.excluded[name] for name in ("entries", "exits", "revenue", "dwell_seconds")})
+
+def entry_cte(inserted, entry_time: datetime.datetime, lot_id: int = DEFAULT_LOT_ID):
+    """Rollup upsert CTE counting one entry per row returned by the `inserted` CTE."""
+    return _upsert_from(inserted, lot_id, bucket_start(entry_time), entries=1).cte("rollup_entry")
+
+def exit_cte(closed, exit_time: datetime.datetime):
+    """
+    Rollup upsert CTE counting one exit per row returned by the `closed` CTE, which must
+    return entry_time, lot_id and fee. Stay length is rounded to seconds as in rebuild().
+    """
+    dwell = cast(func.extract("epoch", literal(exit_time, DateTime(timezone=True)) - closed.c.entry_time), BigInteger)
+    return _upsert_from(closed, closed.c.lot_id, bucket_start(exit_time), exits=1, revenue=closed.c.fee, dwell_seconds=dwell).cte("rollup_exit")
+
+# --- Reports ---
+def report(db: Session, start: datetime.datetime, end: datetime.datetime, granularity: str = "hour", lot_id: int | None = None) -> list[dict]:
+    """Totals per hour/day in [start, end), summed over lots unless lot_id is given."""
+    if granularity == "day":
+        bucket = func.date_trunc("day", func.timezone(config.REPORT_TIMEZONE, _rollup.c.bucket_start))
+    else:
+        bucket = _rollup.c.bucket_start
+    query = select(bucket.label("bucket"), func.sum(_rollup.c.entries).label("entries"), func.sum(_rollup.c.exits).label("exits"),
+                   func.sum(_rollup.c.revenue).label("revenue"), func.sum(_rollup.c.dwell_seconds).label("dwell_seconds"))\
+        .where(_rollup.c.bucket_start >= start, _rollup.c.bucket_start < end)
+    if lot_id is not None: query = query.where(_rollup.c.lot_id == lot_id)
+    rows = db.execute(query.group_by(bucket).order_by(bucket)).all()
+    return [{"bucket": row.bucket, "entries": int(row.entries), "exits": int(row.exits), "revenue": float(row.revenue),
+             "avg_dwell_seconds": round(row.dwell_seconds / row.exits) if row.exits else None} for row in rows]
+
+# --- Rebuild ---
+_REBUILD_SQL = text("""
+INSERT INTO parking_rollups (lot_id, bucket_start, entries, exits, revenue, dwell_seconds)
+SELECT lot_id, bucket, SUM(entries), SUM(exits), SUM(revenue), SUM(dwell_seconds)
+FROM (
+    SELECT lot_id, date_trunc('hour', entry_time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS bucket,
+           1 AS entries, 0 AS exits, 0 AS revenue, 0 AS dwell_seconds
+    FROM parking_records WHERE entry_time >= :start AND entry_time < :end
+    UNION ALL
+    SELECT lot_id, date_trunc('hour', exit_time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+           0, 1, COALESCE(fee, 0), CAST(EXTRACT(EPOCH FROM exit_time - entry_time) AS BIGINT)
+    FROM parking_records WHERE exit_time >= :start AND exit_time < :end
+) deltas
+GROUP BY lot_id, bucket
+""")
+
+def rebuild(db: Session, start: datetime.datetime | None = None, end: datetime.datetime | None = None) -> int:
+    """
+    Recomputes the rollups for [start, end) (hour-aligned; everything by default) in one transaction.
+    Hours before the archive horizon are kept as they are: their records are no longer in the database.
+    """
+    from app import partitions
+    start = bucket_start(start) if start else datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+    horizon = partitions.archive_horizon()
+    if horizon is not None and start < horizon:
+        print(f"Keeping archived rollups: rebuilding from {horizon.isoformat()} instead of {start.isoformat()}.")
+        start = horizon
+    end = bucket_start(end) if end else datetime.datetime(9999, 1, 1, tzinfo=pytz.utc)
+    db.execute(delete(_rollup).where(_rollup.c.bucket_start >= start, _rollup.c.bucket_start < end))
+    inserted = db.execute(_REBUILD_SQL, {"start": start, "end": end}).rowcount
+    db.commit()
+    return inserted
+
+if __name__ == "__main__":
+    import argparse
+    from app import database
+    parser = argparse.ArgumentParser(description="Rebuild parking_rollups from parking_records.")
+    parser.add_argument("--rebuild", action="store_true", required=True)
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, help="First hour to rebuild (UTC if no offset)")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat, help="Rebuild up to this hour (exclusive)")
+    args = parser.parse_args()
+    with database.SessionLocal() as db:
+        print(f"Rebuilt {rebuild(db, args.start, args.end)} rollup buckets.")
@@ -0,0 +1,393 @@
+# app/scan_journal.py
+"""
+Write-behind scan journal (config.SCAN_JOURNAL_ENABLED).
+
+Accepted check-in/check-out scans are appended to a local JSONL file and
+fsynced before the gate gets its answer (concurrent appends share one fsync).
+A background task applies them to the database in batches through
+crud.apply_scan_events, one transaction per batch. The batch's last sequence
+number is upserted into scan_journal_offsets in that same transaction, so a
+replay after a crash applies every scan exactly once.
+
+Each worker process writes its own file (scans-<pid>-<ms>.jsonl) and holds an
+exclusive flock on it. At startup a worker adopts the files whose lock is free
+(their process died), applies their unapplied tail before its own scans, then
+deletes them. Without fcntl (Windows) every other file is adopted, so run a
+single worker there.
+
+Capacity is enforced against lots.occupied, the counter every worker shares: a
+worker leases SCAN_JOURNAL_LEASE_PLACES places at a time (counted as occupied
+at once, see crud.lease_places) and a journaled check-in uses one of them, so
+workers cannot overfill a lot between flushes. Each lease is written to the
+journal file, so whoever deletes the file hands back the places no check-in
+used (a clean stop, or the worker adopting a dead worker's file). Places
+leased by a worker that died before writing the lease stay counted (the lot
+looks fuller, never emptier) until crud.recount_lot_occupancy runs.
+
+A scan acknowledged from the journal can still be rejected when applied, when
+another worker handled the same vehicle in between (checked it in or out
+twice). It is logged, counted, and appended to rejected.jsonl in the journal
+directory for manual reconciliation; the next occupancy resync corrects the
+in-memory state.
+
+A worker only knows its own unapplied scans. When the synchronous path rejects
+a scan (not checked in / already checked in), wait_for_peers() looks for an
+unapplied scan of the same QR code in the other workers' files and waits up to
+SCAN_JOURNAL_PEER_WAIT_MS for it to be applied before the scan is retried.
+"""
+
+import asyncio
+import datetime
+import glob
+import json
+import os
+import time
+from collections import deque
+
+import pytz
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app import config, crud, database, models, schemas
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locking, see module docstring
+    fcntl = None
+
+_ROTATE_BYTES = 64 * 1024 * 1024 # Start a new file once the current one is fully applied and this large
+
+def _read_entries(path: str, after_seq: int = 0) -> list[dict]:
+    """Entries with seq > after_seq. Stops at a torn last line (never acknowledged: its fsync did not finish)."""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try: entry = json.loads(line)
+            except ValueError: break
+            if entry["seq"] > after_seq: entries.append(entry)
+    return entries
+
+def _apply(db: Session, journal_id: str, entries: list[dict]) -> list[dict]:
+    """
+    Applies entries and records the journal offset in one transaction. Entries at or
+    below the stored offset are skipped, so re-sending a batch whose commit outlived
+    its caller (a cancelled flush, say) is harmless.
+    """
+    applied = db.scalar(select(models.ScanJournalOffset.seq).where(models.ScanJournalOffset.journal_id == journal_id).with_for_update()) or 0
+    entries = [e for e in entries if e["seq"] > applied]
+    if not entries: db.rollback(); return []
+    events = [schemas.ScanEvent(qr_code=e["qr_code"], action=e["action"], timestamp=datetime.datetime.fromisoformat(e["timestamp"]),
+                                lot_id=e["lot_id"]) for e in entries]
+    results = crud.apply_scan_events(db, events, preclaimed=True) # Check-in places come from this journal's leases
+    offset = pg_insert(models.ScanJournalOffset).values(journal_id=journal_id, seq=entries[-1]["seq"])
+    db.execute(offset.on_conflict_do_update(index_elements=[models.ScanJournalOffset.journal_id], set_={"seq": offset.excluded.seq}))
+    db.commit()
+    return results
+
+def _applied_seq(db: Session, journal_id: str) -> int:
+    return db.scalar(select(models.ScanJournalOffset.seq).where(models.ScanJournalOffset.journal_id == journal_id)) or 0
+
+def _applied_seqs(db: Session, journal_ids: list[str]) -> dict[str, int]:
+    offset = models.ScanJournalOffset
+    return dict(db.execute(select(offset.journal_id, offset.seq).where(offset.journal_id.in_(journal_ids))).all())
+
+def _forget(db: Session, journal_id: str, unused: dict[int, int] | None = None) -> None:
+    """
+    Drops a deleted file's offset row and hands back its unused leased places. Always
+    after the file is gone: a file without its row would be replayed from the start.
+    """
+    if unused: crud.release_places(db, unused)
+    db.execute(delete(models.ScanJournalOffset).where(models.ScanJournalOffset.journal_id == journal_id)); db.commit()
+
+def _lease(db: Session, lot_id: int, places: int) -> int:
+    granted = crud.lease_places(db, lot_id, places); db.commit(); return granted
+
+def _release(db: Session, places: dict[int, int]) -> None:
+    crud.release_places(db, places); db.commit()
+
+def _unused_places(entries: list[dict]) -> dict[int, int]:
+    """Places leased in a journal file that none of its check-ins used, per lot (applied or not, each check-in holds one)."""
+    unused = {}
+    for e in entries:
+        if e["action"] == "lease": unused[e["lot_id"]] = unused.get(e["lot_id"], 0) + e["places"]
+        elif e["action"] == "checkin": unused[e["lot_id"]] = unused.get(e["lot_id"], 0) - 1
+    return unused
+
+def _record_rejected(path: str, lines: list[str]) -> None:
+    with open(path, "a", encoding="utf-8") as f: f.write("".join(lines))
+
+class ScanJournal:
+    def __init__(self, directory: str, batch_size: int, flush_seconds: float, lease_size: int):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.lease_size = lease_size
+        self.journal_id: str | None = None
+        self._file = None
+        self._next_seq = 1
+        self._writes: list[tuple[str, asyncio.Future]] = [] # Encoded lines waiting for the writer
+        self._pending: deque[dict] = deque()                 # Durable, not yet applied (own file)
+        self._orphans: list[tuple[str, object, deque, dict]] = [] # (journal_id, locked file, entries, unused places) adopted from dead workers
+        self._places: dict[int, int] = {}                    # lot_id -> leased places not used yet (own file)
+        self._write_lock = asyncio.Lock()
+        self._lease_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock() # One flush at a time: batches are popped only after they commit
+        self._write_wakeup = asyncio.Event()
+        self._flush_wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._peers: dict[str, tuple[int, dict[str, int]]] = {} # Other workers' files: path -> (bytes read, qr_code -> last seq)
+        self._peer_lock = asyncio.Lock()
+        self.running = False # Set once start() completed; append() is refused otherwise (nothing would write its line)
+        self.appended = self.applied = self.rejected = self.flush_failures = 0
+        self.last_flush_at: datetime.datetime | None = None
+
+    # --- Lifecycle ---
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(self.directory, "scans-*.jsonl"))):
+            try: await self._adopt(path)
+            except Exception as e: print(f"Scan journal: could not adopt {path}, retrying at next start ({e})")
+        self._open_new_file()
+        if self._orphans:
+            try: await self.flush() # Before the occupancy snapshot is taken, if the database is reachable
+            except Exception as e: print(f"Scan journal: replay deferred to the background flusher ({e})")
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._writer()), loop.create_task(self._flusher())]
+        self.running = True
+
+    async def stop(self) -> None:
+        """Writes and applies what it can; unapplied scans stay on disk for the next worker to adopt."""
+        self.running = False
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True); self._tasks = []
+        try:
+            await self._write_pending()
+            while self._pending or self._orphans: await self.flush()
+        except Exception as e: print(f"Scan journal: {self.pending()} scans left for replay ({e})")
+        for _, handle, _, _ in self._orphans: handle.close()
+        await self._close_current(delete=not self._pending, unused=self._places) # Kept file: its adopter hands them back
+
+    def _open_new_file(self) -> None:
+        """Creates and locks the file under a hidden name, then renames it, so no other worker can adopt it first."""
+        self.journal_id = f"scans-{os.getpid()}-{int(time.time() * 1000)}.jsonl"
+        path = os.path.join(self.directory, self.journal_id)
+        self._file = open(os.path.join(self.directory, f".{self.journal_id}"), "ab")
+        if fcntl is not None: fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(self._file.name, path) # Sequence numbers keep counting across files: offsets compare against them
+
+    async def _close_current(self, delete: bool, unused: dict[int, int] | None = None) -> None:
+        path, journal_id = os.path.join(self.directory, self.journal_id), self.journal_id
+        self._file.close() # Releases the flock
+        if delete:
+            os.remove(path)
+            try: await database.run_in_new_session(_forget, journal_id, unused)
+            except Exception as e: print(f"Scan journal: could not drop offset of {journal_id} ({e})")
+
+    async def _adopt(self, path: str) -> None:
+        """Queues the unapplied tail of a dead worker's journal file."""
+        f = open(path, encoding="utf-8")
+        if fcntl is not None:
+            try: fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: f.close(); return # Owned by a live worker
+        journal_id = os.path.basename(path)
+        try: applied, entries = await database.run_in_new_session(_applied_seq, journal_id), await asyncio.to_thread(_read_entries, path)
+        except Exception: f.close(); raise
+        scans = deque(e for e in entries if e["action"] != "lease" and e["seq"] > applied)
+        self._orphans.append((journal_id, f, scans, _unused_places(entries))) # The handle keeps the lock until the file is deleted
+        print(f"Scan journal: adopted {journal_id} with {len(scans)} unapplied scans.")
+
+    # --- Place leases ---
+    async def take_place(self, lot_id: int) -> bool:
+        """
+        Takes a place for a journaled check-in from this worker's lease, leasing more
+        from lots.occupied when it runs out. False when the lot is full or unknown.
+        A check-in that is then not appended must give_back() its place.
+        """
+        async with self._lease_lock:
+            if not self._places.get(lot_id):
+                granted = await database.run_in_new_session(_lease, lot_id, self.lease_size)
+                if not granted: return False
+                try: await self._write_entry({"action": "lease", "lot_id": lot_id, "places": granted})
+                except Exception: await database.run_in_new_session(_release, {lot_id: granted}); raise
+                self._places[lot_id] = granted
+            self._places[lot_id] -= 1
+            return True
+
+    def give_back(self, lot_id: int) -> None:
+        self._places[lot_id] = self._places.get(lot_id, 0) + 1
+
+    # --- Append (group commit) ---
+    async def append(self, qr_code: str, action: str, timestamp: datetime.datetime, lot_id: int, vehicle_id: int, license_plate: str) -> int:
+        """
+        Returns once the scan is on disk (fsynced). Its sequence number orders it within this worker.
+        A check-in must hold a place from take_place().
+        """
+        if not self.running: raise RuntimeError("Scan journal is not running.")
+        entry = await self._write_entry({"qr_code": qr_code, "action": action, "timestamp": timestamp.isoformat(), "lot_id": lot_id,
+                                         "vehicle_id": vehicle_id, "license_plate": license_plate})
+        self._pending.append(entry)
+        self.appended += 1
+        if len(self._pending) >= self.batch_size: self._flush_wakeup.set()
+        return entry["seq"]
+
+    async def _write_entry(self, fields: dict) -> dict:
+        entry = {"seq": self._next_seq, **fields}
+        self._next_seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((json.dumps(entry) + "\n", future))
+        self._write_wakeup.set()
+        await future
+        return entry
+
+    def _write(self, lines: list[str]) -> None:
+        position = self._file.tell()
+        try: self._file.write("".join(lines).encode("utf-8")); self._file.flush(); os.fsync(self._file.fileno())
+        except Exception:
+            os.ftruncate(self._file.fileno(), position); self._file.seek(position) # No torn line in front of later appends
+            raise
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            batch, self._writes = self._writes, []
+            if not batch: return
+            try: await asyncio.to_thread(self._write, [line for line, _ in batch])
+            except Exception as e:
+                for _, future in batch: future.set_exception(e)
+                return
+            for _, future in batch: future.set_result(None)
+
+    async def _writer(self) -> None:
+        while True:
+            await self._write_wakeup.wait(); self._write_wakeup.clear()
+            await self._write_pending()
+
+    # --- Flush ---
+    async def flush(self) -> None:
+        """Applies adopted journals first (they are older), then one batch of this worker's scans."""
+        async with self._flush_lock: await self._flush()
+
+    async def _flush(self) -> None:
+        while self._orphans:
+            journal_id, handle, entries, unused = self._orphans[0]
+            while entries:
+                batch = [entries[i] for i in range(min(self.batch_size, len(entries)))]
+                await self._apply_batch(journal_id, batch)
+                for _ in batch: entries.popleft()
+            os.remove(handle.name); handle.close(); self._orphans.pop(0)
+            await database.run_in_new_session(_forget, journal_id, unused)
+        if self._pending:
+            batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+            await self._apply_batch(self.journal_id, batch)
+            for _ in batch: self._pending.popleft()
+        if not self._pending and not self._writes and self._file.tell() > _ROTATE_BYTES:
+            async with self._write_lock:
+                if not self._pending and not self._writes:
+                    await self._close_current(delete=True); self._open_new_file()
+                    # Unused places move to the new file (a crash before this line only leaves them counted)
+                    carried = []
+                    for lot_id, places in self._places.items():
+                        if places > 0: carried.append({"seq": self._next_seq, "action": "lease", "lot_id": lot_id, "places": places}); self._next_seq += 1
+                    if carried: await asyncio.to_thread(self._write, [json.dumps(e) + "\n" for e in carried])
+
+    async def _apply_batch(self, journal_id: str, batch: list[dict]) -> None:
+        results = await database.run_in_new_session(_apply, journal_id, batch)
+        rejected = [r for r in results if r["status_code"] != 200]
+        for r in rejected: print(f"Scan journal: {r['action']} of {r['qr_code']} rejected when applied: {r['message']}")
+        if rejected: # results index the entries _apply kept, the tail of batch
+            kept = batch[len(batch) - len(results):]
+            lines = [json.dumps({**kept[r["index"]], "journal_id": journal_id, "status_code": r["status_code"], "message": r["message"]}) + "\n" for r in rejected]
+            try: await asyncio.to_thread(_record_rejected, os.path.join(self.directory, "rejected.jsonl"), lines)
+            except Exception as e: print(f"Scan journal: could not record rejected scans ({e})")
+        self.applied += len(results) - len(rejected); self.rejected += len(rejected)
+        self.last_flush_at = datetime.datetime.now(pytz.utc)
+
+    async def _flusher(self) -> None:
+        backoff = self.flush_seconds
+        while True:
+            try: await asyncio.wait_for(self._flush_wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError: pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+                backoff = self.flush_seconds
+                if len(self._pending) >= self.batch_size: self._flush_wakeup.set() # Still behind: go again at once
+            except Exception as e:
+                self.flush_failures += 1; backoff = min(backoff * 2, 30.0) # Database slow or down: keep the scans, retry later
+                print(f"Scan journal flush failed ({len(self._pending)} pending, retry in {backoff:.1f}s): {e}")
+
+    # --- Other workers' scans ---
+    def _read_peers(self) -> None:
+        """Reads what other workers appended since the last call (files are append-only, so each is read once)."""
+        own = {self.journal_id} | {journal_id for journal_id, _, _, _ in self._orphans}
+        paths = {p for p in glob.glob(os.path.join(self.directory, "scans-*.jsonl")) if os.path.basename(p) not in own}
+        for gone in self._peers.keys() - paths: del self._peers[gone]
+        for path in paths:
+            position, seqs = self._peers.get(path, (0, {}))
+            try:
+                with open(path, "rb") as f:
+                    f.seek(position)
+                    for line in f:
+                        if not line.endswith(b"\n"): break # Still being written
+                        try: entry = json.loads(line)
+                        except ValueError: break
+                        position += len(line)
+                        if "qr_code" in entry: seqs[entry["qr_code"]] = entry["seq"]
+            except FileNotFoundError: continue # Applied and deleted meanwhile
+            self._peers[path] = (position, seqs)
+
+    async def wait_for_peers(self, qr_code: str, timeout: float) -> bool:
+        """
+        Waits until no other worker's journal holds an unapplied scan of qr_code.
+        False when no other worker journaled it (the rejection stands), True once
+        their scans are applied (retry: one may have landed after the rejection);
+        TimeoutError when they are still pending after timeout seconds.
+        """
+        async with self._peer_lock: await asyncio.to_thread(self._read_peers)
+        waiting = {os.path.basename(path): seqs[qr_code] for path, (_, seqs) in self._peers.items() if qr_code in seqs}
+        found, deadline = bool(waiting), time.monotonic() + timeout
+        while waiting:
+            applied = await database.run_in_new_session(_applied_seqs, list(waiting))
+            waiting = {journal_id: seq for journal_id, seq in waiting.items() # A deleted file was fully applied
+                       if applied.get(journal_id, 0) < seq and os.path.exists(os.path.join(self.directory, journal_id))}
+            if not waiting: break
+            if time.monotonic() >= deadline: raise TimeoutError(f"Scans of {qr_code} are still pending in {', '.join(waiting)}.")
+            await asyncio.sleep(self.flush_seconds / 4)
+        return found
+
+    # --- Occupancy resync ---
+    async def overlay(self, read) -> dict:
+        """
+        read(db) -> {vehicle_id: session} (occupancy.read_sessions) with no batch
+        committing meanwhile, then this worker's unapplied scans laid over it, oldest
+        first: the database state plus what only this worker knows so far.
+        """
+        async with self._flush_lock:
+            sessions = await database.run_in_new_session(read)
+            for e in [e for _, _, entries, _ in self._orphans for e in entries] + list(self._pending):
+                if e.get("vehicle_id") is None: continue
+                if e["action"] == "checkin":
+                    sessions[e["vehicle_id"]] = {"record_id": None, "vehicle_id": e["vehicle_id"], "lot_id": e["lot_id"],
+                                                 "license_plate": e["license_plate"], "entry_time": datetime.datetime.fromisoformat(e["timestamp"])}
+                else: sessions.pop(e["vehicle_id"], None)
+        return sessions
+
+    # --- Observability ---
+    def pending(self) -> int:
+        return len(self._pending) + sum(len(entries) for _, _, entries, _ in self._orphans)
+
+    def has_pending(self, qr_code: str) -> bool:
+        return any(e["qr_code"] == qr_code for e in self._pending) or any(e["qr_code"] == qr_code for _, _, entries, _ in self._orphans for e in entries)
+
+    def lag_seconds(self) -> float:
+        """Age of the oldest scan not yet applied to the database (0 when caught up)."""
+        oldest = self._orphans[0][2][0] if self._orphans and self._orphans[0][2] else (self._pending[0] if self._pending else None)
+        if oldest is None: return 0.0
+        return max(0.0, (datetime.datetime.now(pytz.utc) - datetime.datetime.fromisoformat(oldest["timestamp"])).total_seconds())
+
+    def stats(self) -> dict:
+        return {"enabled": True, "running": self.running, "journal_id": self.journal_id, "pending": self.pending(), "lag_seconds": round(self.lag_seconds(), 3),
+                "appended": self.appended, "applied": self.applied, "rejected": self.rejected, "flush_failures": self.flush_failures,
+                "leased_places": sum(self._places.values()), "last_flush_at": self.last_flush_at}
+
+scan_journal = ScanJournal(config.SCAN_JOURNAL_DIR, config.SCAN_JOURNAL_BATCH_SIZE, config.SCAN_JOURNAL_FLUSH_MS / 1000, config.SCAN_JOURNAL_LEASE_PLACES)
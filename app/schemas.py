@@ -1,7 +1,7 @@
 # app/schemas.py
 
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Literal
 import datetime
 from decimal import Decimal
 
@@ -32,10 +32,22 @@ class VehicleRegistrationResponse(BaseModel):
 # --- Parking Spot Schemas (REMOVED) ---
 # ParkingSpotBase, ParkingSpot, ParkingSpotStatus are no longer needed
 
+# --- Lot Schemas ---
+class LotCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    capacity: Optional[int] = Field(None, ge=0, description="Maximum vehicles inside; omit for unlimited")
+class LotUpdate(BaseModel):
+    capacity: Optional[int] = Field(..., ge=0, description="New capacity; null for unlimited (required: an empty body is rejected)")
+class Lot(LotCreate):
+    id: int
+    occupied: int
+    model_config = ConfigDict(from_attributes=True)
+
 # --- Check-in / Check-out Schemas ---
 class CheckInRequest(BaseModel):
     # Only need QR code now, spot number removed
     qr_code: str = Field(..., description="QR code data scanned from the vehicle")
+    lot_id: int = Field(0, description="Lot the gate belongs to (0 = default lot)")
 
 class CheckOutRequest(BaseModel):
     qr_code: str = Field(..., description="QR code data scanned from the vehicle")
@@ -53,8 +65,54 @@ class VehicleStatusResponse(BaseModel):
     exit_time: Optional[datetime.datetime] = None
     duration_hours: Optional[float] = None
     fee: Optional[float] = None
+    lot_id: Optional[int] = None
     model_config = ConfigDict(from_attributes=True) # Allow creation from dicts
 
+# --- Batched Scan Events (gate replay) ---
+class ScanEvent(BaseModel):
+    qr_code: str = Field(..., description="QR code data scanned from the vehicle")
+    action: Literal["checkin", "checkout"]
+    timestamp: datetime.datetime = Field(..., description="Device time of the scan (UTC if no offset given)")
+    lot_id: int = Field(0, description="Lot of the gate (check-in only; check-out uses the record's lot)")
+
+class ScanEventBatchRequest(BaseModel):
+    events: List[ScanEvent] = Field(..., min_length=1, max_length=1000, description="Events in the order they were scanned")
+
+class ScanEventResult(BaseModel):
+    index: int
+    qr_code: str
+    action: str
+    status_code: int
+    message: str
+    is_checked_in: Optional[bool] = None
+    license_plate: Optional[str] = None
+    owner_name: Optional[str] = None
+    owner_phone_number: Optional[str] = None
+    entry_time: Optional[datetime.datetime] = None
+    exit_time: Optional[datetime.datetime] = None
+    duration_hours: Optional[float] = None
+    fee: Optional[float] = None
+    lot_id: Optional[int] = None
+
+class ScanEventBatchResponse(BaseModel):
+    applied: int
+    rejected: int
+    results: List[ScanEventResult]
+
+# --- Parking History ---
+class ParkingRecordOut(BaseModel):
+    id: int
+    vehicle_id: int
+    lot_id: int
+    license_plate: str
+    entry_time: datetime.datetime
+    exit_time: Optional[datetime.datetime] = None
+    fee: Optional[float] = None
+
+class ParkingRecordPage(BaseModel):
+    items: List[ParkingRecordOut]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= for the next (older) page
+
 # Optional: Separate schema if CheckOut response needs different structure than Status/CheckIn
 # class CheckOutDetailsResponse(VehicleStatusResponse):
 #     # Inherits fields, could add more if needed
@@ -0,0 +1,217 @@
+# app/tariff.py
+"""
+Tariff engine.
+
+A tariff is compiled once into a table of per-hour-of-day rates (in cents) and
+its prefix sums over two days. Pricing a stay is then integer arithmetic:
+
+    hours   = ceil(duration / 1h)            (0 within the grace period)
+    h0      = local hour-of-day of entry
+    fee     = (hours // 24) * min(day_total, daily_cap)
+            + min(P[h0 + hours % 24] - P[h0], daily_cap)
+
+i.e. each started hour is charged at the band rate in force when that hour
+began, and every 24-hour block since entry is capped at the daily cap.
+price() (single record), sql_fee() (the same math in SQL, used by checkout
+to price inside the closing UPDATE) and price_batch_cents() (NumPy, for
+repricing history) run the same integer math and give identical results.
+
+Tariffs come from TARIFF_FILE (JSON) when set:
+
+    {"default": {"rate": "20.00",
+                 "bands": [{"from_hour": 8, "to_hour": 20, "rate": "30.00"}],
+                 "grace_minutes": 10, "daily_cap": "200.00", "utc_offset_minutes": 330},
+     "lots": {"2": {"rate": "40.00"}}}
+
+Without it, the default is a flat PARKING_RATE_PER_HOUR per started hour,
+which is exactly the historical behaviour.
+
+Usage (reprice / what-if):
+    python -m app.tariff --start 2026-01-01 --end 2026-02-01 [--tariff-file whatif.json] [--apply]
+"""
+
+import datetime
+import json
+from decimal import Decimal
+
+import pytz
+
+from app import config
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+_US_PER_HOUR = 3_600_000_000
+_US_PER_MINUTE = 60_000_000
+
+def _cents(amount) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1")))
+
+def _epoch_us(moment: datetime.datetime) -> int:
+    """Exact integer microseconds since the epoch (naive datetimes are taken as UTC)."""
+    if moment.tzinfo is None: moment = pytz.utc.localize(moment)
+    return (moment - _EPOCH) // datetime.timedelta(microseconds=1)
+
+class Tariff:
+    """A compiled tariff: hourly rate table, grace period, daily cap and local-time offset."""
+
+    def __init__(self, hourly_rates_cents: list[int], grace_minutes: int = 0, daily_cap_cents: int | None = None,
+                 utc_offset_minutes: int = 0, name: str = "default"):
+        if len(hourly_rates_cents) != 24: raise ValueError("A tariff needs exactly 24 hourly rates.")
+        if any(rate < 0 for rate in hourly_rates_cents): raise ValueError("Tariff rates cannot be negative.")
+        self.name = name
+        self.hourly_rates_cents = list(hourly_rates_cents)
+        self.grace_us = grace_minutes * _US_PER_MINUTE
+        self.offset_us = utc_offset_minutes * _US_PER_MINUTE
+        self.day_total_cents = sum(hourly_rates_cents)
+        self.daily_cap_cents = self.day_total_cents if daily_cap_cents is None else min(daily_cap_cents, self.day_total_cents)
+        # P[i] = cost of the first i hour slots starting at local midnight, over two days
+        self.prefix_cents = [0]
+        for i in range(48): self.prefix_cents.append(self.prefix_cents[-1] + hourly_rates_cents[i % 24])
+
+    @classmethod
+    def from_dict(cls, spec: dict, name: str = "default") -> "Tariff":
+        """Builds a tariff from its JSON form (see module docstring)."""
+        rates = [_cents(spec.get("rate", config.PARKING_RATE_PER_HOUR))] * 24
+        for band in spec.get("bands", []):
+            start, end, rate = int(band["from_hour"]), int(band["to_hour"]), _cents(band["rate"])
+            if not (0 <= start < 24 and 0 < end <= 24 and start != end): raise ValueError(f"Invalid band hours {start}-{end} in tariff '{name}'.")
+            for hour in range(start, end if end > start else end + 24): rates[hour % 24] = rate # Bands may wrap midnight
+        cap = spec.get("daily_cap")
+        return cls(rates, grace_minutes=int(spec.get("grace_minutes", 0)), daily_cap_cents=_cents(cap) if cap is not None else None,
+                   utc_offset_minutes=int(spec.get("utc_offset_minutes", 0)), name=name)
+
+    # --- Single record ---
+    def price_cents_us(self, entry_us: int, exit_us: int) -> int:
+        duration = exit_us - entry_us
+        if duration <= self.grace_us: return 0
+        hours = -(-duration // _US_PER_HOUR)
+        days, rest = divmod(hours, 24)
+        start = ((entry_us + self.offset_us) // _US_PER_HOUR) % 24
+        partial = self.prefix_cents[start + rest] - self.prefix_cents[start]
+        return days * self.daily_cap_cents + min(partial, self.daily_cap_cents)
+
+    def price(self, entry_time: datetime.datetime, exit_time: datetime.datetime) -> Decimal:
+        """Fee for one stay, as a 2-decimal Decimal."""
+        return (Decimal(self.price_cents_us(_epoch_us(entry_time), _epoch_us(exit_time))) / 100).quantize(Decimal("0.01"))
+
+    # --- Batch (NumPy) ---
+    def price_batch_cents(self, entry_us, exit_us):
+        """Vectorized price_cents_us over int64 arrays of epoch microseconds; returns int64 cents."""
+        import numpy as np # Optional dependency, only needed for batch pricing
+        entry_us = np.asarray(entry_us, dtype=np.int64); exit_us = np.asarray(exit_us, dtype=np.int64)
+        prefix = np.asarray(self.prefix_cents, dtype=np.int64)
+        duration = exit_us - entry_us
+        hours = -(-duration // _US_PER_HOUR)
+        days, rest = np.divmod(hours, 24)
+        start = ((entry_us + self.offset_us) // _US_PER_HOUR) % 24
+        partial = np.minimum(prefix[start + np.clip(rest, 0, 23)] - prefix[start], self.daily_cap_cents)
+        return np.where(duration <= self.grace_us, 0, days * self.daily_cap_cents + partial)
+
+    def price_batch(self, entry_times, exit_times):
+        """Vectorized price() over sequences of datetimes; returns int64 cents."""
+        import numpy as np
+        return self.price_batch_cents(np.fromiter((_epoch_us(t) for t in entry_times), dtype=np.int64),
+                                      np.fromiter((_epoch_us(t) for t in exit_times), dtype=np.int64))
+
+# --- Registry ---
+def load_tariffs(path: str | None) -> tuple[Tariff, dict[int, Tariff]]:
+    """Loads (default, per-lot) tariffs from a JSON file; the flat hourly rate when path is empty."""
+    if not path: return Tariff.from_dict({}), {}
+    with open(path) as f: spec = json.load(f)
+    default_spec = spec.get("default", {})
+    lots = {int(lot): Tariff.from_dict({**default_spec, **lot_spec}, name=f"lot {lot}") for lot, lot_spec in spec.get("lots", {}).items()}
+    return Tariff.from_dict(default_spec), lots
+
+try:
+    default_tariff, lot_tariffs = load_tariffs(config.TARIFF_FILE)
+except (OSError, ValueError, KeyError) as e:
+    print(f"Warning: could not load TARIFF_FILE ('{config.TARIFF_FILE}'): {e}. Using flat PARKING_RATE_PER_HOUR.")
+    default_tariff, lot_tariffs = load_tariffs(None)
+
+def get_tariff(lot_id: int | None = None) -> Tariff:
+    """Tariff for a lot, falling back to the default tariff."""
+    return lot_tariffs.get(lot_id, default_tariff) if lot_id is not None else default_tariff
+
+# --- SQL (checkout) ---
+def sql_epoch_us(column):
+    """Epoch microseconds of a timestamptz column, as BIGINT (exact on PostgreSQL 14+, where EXTRACT returns numeric)."""
+    from sqlalchemy import func, cast, BigInteger
+    return cast(func.floor(func.extract("epoch", column) * 1_000_000), BigInteger)
+
+def sql_fee(entry_time, lot_id, exit_time: datetime.datetime):
+    """
+    price() as a SQL expression over a record's entry_time and lot_id columns, for
+    pricing inside the statement that closes the record. Every configured tariff is
+    sent as one VALUES row (prefix sums as a BIGINT[] parameter) and the record's
+    lot picks its row, so the fee runs the same integer math as price_cents_us.
+    """
+    from sqlalchemy import values, column, select, case, cast, func, literal, BigInteger, Integer, Numeric
+    from sqlalchemy.dialects.postgresql import ARRAY
+    default_key = -1 # lot_id of the default tariff's row
+    tariffs = values(column("lot_id", Integer), column("prefix", ARRAY(BigInteger)), column("grace_us", BigInteger),
+                     column("offset_us", BigInteger), column("cap", BigInteger), name="tariffs")\
+        .data([(key, t.prefix_cents, t.grace_us, t.offset_us, t.daily_cap_cents)
+               for key, t in [(default_key, default_tariff), *lot_tariffs.items()]])
+    key = case((lot_id.in_(list(lot_tariffs)), lot_id), else_=default_key) if lot_tariffs else literal(default_key)
+    duration = literal(_epoch_us(exit_time), BigInteger) - sql_epoch_us(entry_time)
+    hours = (duration + (_US_PER_HOUR - 1)) // _US_PER_HOUR # ceil; duration > grace_us >= 0 where used
+    start = ((sql_epoch_us(entry_time) + tariffs.c.offset_us) // _US_PER_HOUR) % 24
+    partial = tariffs.c.prefix[start + hours % 24 + 1] - tariffs.c.prefix[start + 1] # PostgreSQL arrays are 1-based
+    cents = case((duration <= tariffs.c.grace_us, 0), else_=(hours // 24) * tariffs.c.cap + func.least(partial, tariffs.c.cap))
+    return select(cast(cast(cents, Numeric) / 100, Numeric(10, 2))).select_from(tariffs).where(tariffs.c.lot_id == key).scalar_subquery()
+
+# --- Repricing ---
+def reprice(db, start: datetime.datetime, end: datetime.datetime, tariff: Tariff | None = None, apply: bool = False, chunk_size: int = 50_000) -> dict:
+    """
+    Prices every closed record with entry_time in [start, end) using batch pricing,
+    each with its lot's tariff (or `tariff` for all of them, for what-if runs).
+    With apply=True the new fees are written back (one executemany per chunk) and the
+    revenue of the affected exit-hour rollup buckets is adjusted by the difference,
+    in the same transaction, so revenue reports match the new fees.
+    """
+    import numpy as np
+    from sqlalchemy import select, update, bindparam
+    from app import models
+    record, rollup = models.ParkingRecord, models.ParkingRollup.__table__
+    rows = db.execute(select(record.id, sql_epoch_us(record.entry_time), sql_epoch_us(record.exit_time), record.fee, record.lot_id)
+                      .where(record.entry_time >= start, record.entry_time < end, record.exit_time.is_not(None))
+                      .order_by(record.id).execution_options(yield_per=chunk_size))
+    summary = {"records": 0, "changed": 0, "old_total": Decimal("0.00"), "new_total": Decimal("0.00")}
+    for chunk in rows.partitions():
+        ids, entries, exits, fees, lots = zip(*chunk)
+        entries, exits, lots = np.array(entries, dtype=np.int64), np.array(exits, dtype=np.int64), np.array(lots, dtype=np.int64)
+        new_cents = np.empty(len(ids), dtype=np.int64)
+        for lot_id in np.unique(lots): # One vectorised pass per lot tariff
+            mask = lots == lot_id
+            new_cents[mask] = (tariff or get_tariff(int(lot_id))).price_batch_cents(entries[mask], exits[mask])
+        old_cents = np.array([_cents(fee) if fee is not None else -1 for fee in fees], dtype=np.int64)
+        changed = np.nonzero(new_cents != old_cents)[0]
+        summary["records"] += len(ids); summary["changed"] += int(changed.size)
+        summary["old_total"] += Decimal(int(old_cents[old_cents >= 0].sum())) / 100
+        summary["new_total"] += Decimal(int(new_cents.sum())) / 100
+        if apply and changed.size:
+            db.execute(update(record).where(record.id == bindparam("record_id")).values(fee=bindparam("new_fee")).execution_options(synchronize_session=False),
+                       [{"record_id": ids[i], "new_fee": (Decimal(int(new_cents[i])) / 100).quantize(Decimal("0.01"))} for i in changed])
+            deltas = {} # (lot_id, exit hour in epoch us) -> revenue change in cents; rollups count a NULL fee as 0
+            for i in changed:
+                key = (int(lots[i]), int(exits[i]) // _US_PER_HOUR * _US_PER_HOUR)
+                deltas[key] = deltas.get(key, 0) + int(new_cents[i]) - max(int(old_cents[i]), 0)
+            buckets = [{"bucket_lot": lot_id, "bucket": _EPOCH + datetime.timedelta(microseconds=hour_us), "delta": Decimal(cents) / 100}
+                       for (lot_id, hour_us), cents in deltas.items() if cents]
+            if buckets: db.execute(update(rollup).where(rollup.c.lot_id == bindparam("bucket_lot"), rollup.c.bucket_start == bindparam("bucket"))
+                                   .values(revenue=rollup.c.revenue + bindparam("delta")), buckets)
+    if apply: db.commit()
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    from app import database
+    parser = argparse.ArgumentParser(description="Recompute fees for closed parking records with the configured (or a what-if) tariff.")
+    parser.add_argument("--start", required=True, type=datetime.date.fromisoformat, help="First entry date (inclusive, UTC)")
+    parser.add_argument("--end", required=True, type=datetime.date.fromisoformat, help="Last entry date (exclusive, UTC)")
+    parser.add_argument("--tariff-file", help="Price with this tariff file's default tariff instead of the configured one")
+    parser.add_argument("--apply", action="store_true", help="Write the new fees (default: report only)")
+    args = parser.parse_args()
+    as_utc = lambda d: datetime.datetime.combine(d, datetime.time(), tzinfo=pytz.utc)
+    whatif = load_tariffs(args.tariff_file)[0] if args.tariff_file else None
+    with database.SessionLocal() as db:
+        print(json.dumps(reprice(db, as_utc(args.start), as_utc(args.end), tariff=whatif, apply=args.apply), indent=2, default=str))
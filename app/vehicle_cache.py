@@ -0,0 +1,80 @@
+# app/vehicle_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from app import config
+
+class VehicleInfo(NamedTuple):
+    """What a scan needs to know about a QR code: the vehicle and its owner."""
+    id: int
+    license_plate: str
+    owner_id: int | None
+    owner_name: str | None
+    owner_phone_number: str | None
+
+class QRCodeCache:
+    """
+    Bounded LRU + TTL cache of qr_code -> VehicleInfo.
+
+    The app never updates or deletes vehicles or owners (bulk import skips existing
+    rows), so the only write is registration, which invalidates its new code. Edits
+    made outside the app (SQL) are picked up within the TTL, which also bounds how
+    long another worker process can serve a stale entry. Thread-safe, since the sync
+    DB path runs crud functions in worker threads.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: int):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, VehicleInfo]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, qr_code: str) -> VehicleInfo | None:
+        with self._lock:
+            entry = self._entries.get(qr_code)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None: del self._entries[qr_code]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(qr_code)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, qr_code: str, info: VehicleInfo) -> None:
+        if self.maxsize <= 0: return
+        with self._lock:
+            self._entries[qr_code] = (time.monotonic() + self.ttl_seconds, info)
+            self._entries.move_to_end(qr_code)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False); self.evictions += 1
+
+    def invalidate(self, qr_code: str) -> None:
+        with self._lock:
+            if self._entries.pop(qr_code, None) is not None: self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock: self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+# Process-wide instance used by crud
+qr_cache = QRCodeCache(maxsize=config.QR_CACHE_SIZE, ttl_seconds=config.QR_CACHE_TTL_SECONDS)
@@ -0,0 +1,59 @@
+# benchmarks/common.py
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies: list[float], elapsed: float | None = None, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (milliseconds) for one benchmark."""
+    values = sorted(latencies)
+    total = elapsed if elapsed is not None else sum(values)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_per_s": round(len(values) / total, 1) if total else None,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else None,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+def timed(fn, iterations: int, warmup: int = 0) -> list[float]:
+    """Calls fn(i) iterations times (after warmup calls) and returns per-call latencies in seconds."""
+    for i in range(warmup): fn(i)
+    latencies = []
+    for i in range(iterations):
+        started = time.perf_counter(); fn(i); latencies.append(time.perf_counter() - started)
+    return latencies
+
+def _git_commit() -> str | None:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def save_results(kind: str, parameters: dict, results: dict, output: str | None = None) -> str:
+    """Writes {meta, parameters, results} as JSON (benchmarks/results/<kind>-<timestamp>.json by default)."""
+    started = datetime.datetime.now(datetime.timezone.utc)
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{kind}-{started:%Y%m%dT%H%M%SZ}.json")
+    document = {
+        "meta": {"kind": kind, "timestamp": started.isoformat(), "git_commit": _git_commit(),
+                 "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "parameters": parameters,
+        "results": results,
+    }
+    with open(output, "w") as f: json.dump(document, f, indent=2, default=str)
+    print(f"Results written to {output}")
+    return output
@@ -0,0 +1,33 @@
+# benchmarks/compare.py
+"""
+Compares two benchmark result files (from crud_micro or load).
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/crud-A.json benchmarks/results/crud-B.json
+"""
+
+import argparse
+import json
+
+METRICS = ("throughput_per_s", "p50_ms", "p95_ms", "p99_ms")
+
+def compare(baseline: dict, candidate: dict) -> list[tuple]:
+    rows = []
+    for name, base_stats in baseline["results"].items():
+        new_stats = candidate["results"].get(name)
+        if not new_stats: continue
+        for metric in METRICS:
+            old, new = base_stats.get(metric), new_stats.get(metric)
+            if old and new is not None: rows.append((name, metric, old, new, (new - old) / old * 100))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark JSON files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+    with open(args.baseline) as f: baseline = json.load(f)
+    with open(args.candidate) as f: candidate = json.load(f)
+    print(f"baseline {baseline['meta'].get('git_commit')} vs candidate {candidate['meta'].get('git_commit')}")
+    for name, metric, old, new, change in compare(baseline, candidate):
+        print(f"{name:45s} {metric:17s} {old:>12} -> {new:>12}  ({change:+.1f}%)")
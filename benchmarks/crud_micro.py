@@ -0,0 +1,72 @@
+# benchmarks/crud_micro.py
+"""
+Micro-benchmarks of the crud hot path against a seeded database (see benchmarks/seed.py).
+
+Usage:
+    python -m benchmarks.crud_micro [--iterations 500] [--output results.json]
+"""
+
+import argparse
+import datetime
+
+import pytz
+from sqlalchemy import select
+
+from app import config, crud, database, models, schemas
+from app.vehicle_cache import qr_cache
+from benchmarks.common import save_results, summarize, timed
+
+def _idle_qr_codes(db, limit: int) -> list[str]:
+    """QR codes of vehicles that are currently checked out."""
+    active = select(models.ParkingRecord.vehicle_id).where(models.ParkingRecord.exit_time.is_(None))
+    return db.scalars(select(models.Vehicle.qr_code).where(models.Vehicle.id.not_in(active)).order_by(models.Vehicle.id).limit(limit)).all()
+
+def run(iterations: int) -> dict:
+    results = {}
+    with database.SessionLocal() as db:
+        qr_codes = _idle_qr_codes(db, iterations)
+        if len(qr_codes) < iterations: raise SystemExit(f"Need {iterations} idle vehicles, found {len(qr_codes)}. Seed more with benchmarks.seed.")
+        pick = lambda i: qr_codes[i % len(qr_codes)]
+
+        def resolve_cold(i): qr_cache.clear(); crud.resolve_vehicle_by_qrcode(db, pick(i))
+        results["resolve_vehicle_by_qrcode_cold"] = summarize(timed(resolve_cold, iterations, warmup=20))
+        results["resolve_vehicle_by_qrcode_warm"] = summarize(timed(lambda i: crud.resolve_vehicle_by_qrcode(db, pick(i)), iterations, warmup=iterations))
+        forged = lambda i: f"V1.{i + 1}.{'A' * 24}" if config.QR_SIGNING_KEY else f"NOSUCHCODE{i}" # Rejected before any query
+        results["resolve_vehicle_by_qrcode_invalid"] = summarize(timed(lambda i: crud.resolve_vehicle_by_qrcode(db, forged(i)), iterations, warmup=20))
+        results["get_vehicle_status_by_qrcode"] = summarize(timed(lambda i: crud.get_vehicle_status_by_qrcode(db, pick(i)), iterations, warmup=20))
+        db.rollback()
+
+        def checkin(i): crud.checkin_vehicle(db, pick(i)); db.commit()
+        def checkout(i): crud.checkout_vehicle(db, pick(i)); db.commit()
+        results["checkin_vehicle+commit"] = summarize(timed(checkin, iterations))
+        results["checkout_vehicle+commit"] = summarize(timed(checkout, iterations))
+
+        batch_size = 50
+        now = datetime.datetime.now(pytz.utc)
+        def replay(i):
+            codes = [pick(i * batch_size + j) for j in range(batch_size)]
+            events = [schemas.ScanEvent(qr_code=qr, action="checkin", timestamp=now) for qr in codes]
+            events += [schemas.ScanEvent(qr_code=qr, action="checkout", timestamp=now + datetime.timedelta(minutes=30)) for qr in codes]
+            crud.apply_scan_events(db, events); db.commit()
+        batches = max(1, iterations // batch_size)
+        results[f"apply_scan_events[{2 * batch_size}]+commit"] = summarize(timed(replay, batches))
+
+        page = crud.list_parking_records(db, limit=50)
+        cursors = [page["next_cursor"]]
+        for _ in range(20):
+            if not cursors[-1]: break
+            cursors.append(crud.list_parking_records(db, cursor=cursors[-1], limit=50)["next_cursor"])
+        deep = [c for c in cursors if c] or [None]
+        results["list_parking_records_first_page"] = summarize(timed(lambda i: crud.list_parking_records(db, limit=50), iterations))
+        results["list_parking_records_deep_page"] = summarize(timed(lambda i: crud.list_parking_records(db, cursor=deep[-1], limit=50), iterations))
+        db.rollback()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark the crud functions.")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/crud-<timestamp>.json)")
+    args = parser.parse_args()
+    results = run(args.iterations)
+    for name, stats in results.items(): print(f"{name:45s} {stats}")
+    save_results("crud", {"iterations": args.iterations}, results, args.output)
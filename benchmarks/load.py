@@ -0,0 +1,65 @@
+# benchmarks/load.py
+"""
+Concurrent HTTP load generator for the scan hot path.
+
+Each virtual gate owns a disjoint set of idle vehicles and loops
+status -> check-in -> status -> check-out, so requests never conflict.
+Reports throughput and p50/p95/p99 latency per endpoint.
+
+Usage (server running against a seeded database):
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app import database
+from benchmarks.common import save_results, summarize
+from benchmarks.crud_micro import _idle_qr_codes
+
+STEPS = (("/api/vehicle-status", "vehicle-status"), ("/api/checkin", "checkin"), ("/api/vehicle-status", "vehicle-status"), ("/api/checkout", "checkout"))
+
+async def _gate(client: httpx.AsyncClient, qr_codes: list[str], deadline: float, latencies: dict, errors: dict) -> None:
+    i = 0
+    while time.perf_counter() < deadline:
+        qr = qr_codes[i % len(qr_codes)]; i += 1
+        for path, name in STEPS:
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json={"qr_code": qr})
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies[name].append(time.perf_counter() - started)
+            if not ok: errors[name] += 1
+
+async def run(url: str, concurrency: int, duration: float, vehicles_per_gate: int) -> dict:
+    with database.SessionLocal() as db:
+        qr_codes = _idle_qr_codes(db, concurrency * vehicles_per_gate)
+    if len(qr_codes) < concurrency: raise SystemExit("Not enough idle vehicles; seed more with benchmarks.seed.")
+    names = {name for _, name in STEPS}
+    latencies, errors = {name: [] for name in names}, {name: 0 for name in names}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(_gate(client, qr_codes[g::concurrency], deadline, latencies, errors) for g in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    results = {name: summarize(latencies[name], elapsed, errors[name]) for name in sorted(names)}
+    results["total"] = summarize([l for values in latencies.values() for l in values], elapsed, sum(errors.values()))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive /api/checkin, /api/checkout and /api/vehicle-status concurrently.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual gates")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run")
+    parser.add_argument("--vehicles-per-gate", type=int, default=20)
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/load-<timestamp>.json)")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.url, args.concurrency, args.duration, args.vehicles_per_gate))
+    for name, stats in results.items(): print(f"{name:16s} {stats}")
+    save_results("load", vars(args), results, args.output)
@@ -0,0 +1,61 @@
+# benchmarks/serialization.py
+"""
+Per-request response serialization cost of the VehicleStatusResponse endpoints
+(/api/vehicle-status, /api/checkin, /api/checkout). No database needed.
+
+"before" replays the previous path: the endpoint builds a VehicleStatusResponse,
+then FastAPI dumps it, validates it against response_model, serializes it again
+and renders it with stdlib json. "after" is the current path (responses.status_body:
+one dict, encoded once by app.responses.dumps, orjson when installed).
+
+Usage:
+    python -m benchmarks.serialization [--iterations 20000] [--output results.json]
+"""
+
+import argparse
+import datetime
+import json
+
+import pytz
+from pydantic import TypeAdapter
+
+from app import responses, schemas
+from benchmarks.common import save_results, summarize, timed
+
+_adapter = TypeAdapter(schemas.VehicleStatusResponse)
+
+def _before(fields: dict) -> bytes:
+    model = schemas.VehicleStatusResponse(**fields)                        # built by the endpoint
+    value = _adapter.validate_python(model.model_dump())                   # response_model validation
+    content = _adapter.dump_python(value, mode="json")                     # response_model serialization
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def _payloads() -> dict[str, dict]:
+    entry = datetime.datetime(2026, 10, 17, 8, 30, 12, 345678, tzinfo=pytz.utc)
+    exit_ = entry + datetime.timedelta(hours=2, minutes=41)
+    owner = {"license_plate": "KA01AB1234", "owner_name": "Asha Rao", "owner_phone_number": "+919800000000"}
+    return {
+        "vehicle-status": {"message": "Vehicle KA01AB1234 is currently checked IN (since 2026-10-17 08:30:12 UTC).",
+                           "is_checked_in": True, **owner, "entry_time": entry, "exit_time": None, "duration_hours": None, "fee": None},
+        "checkin": {"message": "Vehicle KA01AB1234 checked IN successfully.", "is_checked_in": True, **owner, "entry_time": entry},
+        "checkout": {"message": "Vehicle KA01AB1234 checked OUT successfully.", "is_checked_in": False, **owner, "entry_time": entry,
+                     "exit_time": exit_, "duration_hours": 2.683, "fee": 30.0},
+    }
+
+def run(iterations: int) -> dict:
+    results = {}
+    for endpoint, fields in _payloads().items():
+        if json.loads(_before(fields)) != json.loads(responses.status_body(**fields)): raise SystemExit(f"{endpoint}: before/after bodies differ")
+        results[f"{endpoint}:before"] = summarize(timed(lambda i: _before(fields), iterations, warmup=1000))
+        results[f"{endpoint}:after"] = summarize(timed(lambda i: responses.status_body(**fields), iterations, warmup=1000))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark VehicleStatusResponse serialization before/after.")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/serialization-<timestamp>.json)")
+    args = parser.parse_args()
+    results = run(args.iterations)
+    for name, stats in results.items(): print(f"{name:45s} {stats}")
+    encoder = "orjson" if responses.orjson is not None else "json"
+    save_results("serialization", {"iterations": args.iterations, "encoder": encoder}, results, args.output)